@@ -0,0 +1,28 @@
+"""add due item lease
+
+Revision ID: 4c8e2a9f1b73
+Revises: d6e1f8a3b572
+Create Date: 2026-10-16 23:41:08.264913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e2a9f1b73'
+down_revision: Union[str, Sequence[str], None] = 'd6e1f8a3b572'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('due_items', sa.Column('claimed_at', sa.TIMESTAMP(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('due_items', 'claimed_at')
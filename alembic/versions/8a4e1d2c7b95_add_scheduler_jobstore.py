@@ -0,0 +1,41 @@
+"""add scheduler jobstore
+
+Revision ID: 8a4e1d2c7b95
+Revises: 3f1c9a7d2e40
+Create Date: 2026-10-16 13:41:07.502311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e1d2c7b95'
+down_revision: Union[str, Sequence[str], None] = '3f1c9a7d2e40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('scheduler_jobs',
+    sa.Column('id', sa.String(length=191), nullable=False),
+    sa.Column('next_run_time', sa.Float(), nullable=True),
+    sa.Column('job_state', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_scheduler_jobs_next_run_time'), 'scheduler_jobs', ['next_run_time'], unique=False)
+    op.create_table('scheduler_meta',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('scheduler_meta')
+    op.drop_index(op.f('ix_scheduler_jobs_next_run_time'), table_name='scheduler_jobs')
+    op.drop_table('scheduler_jobs')
@@ -0,0 +1,33 @@
+"""add blocked recipients
+
+Revision ID: a9c4e6f21d83
+Revises: f3b8c2d15a97
+Create Date: 2026-10-16 19:12:08.734519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c4e6f21d83'
+down_revision: Union[str, Sequence[str], None] = 'f3b8c2d15a97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('blocked_recipients',
+    sa.Column('chat_id', sa.String(), nullable=False),
+    sa.Column('reason', sa.String(length=32), nullable=False),
+    sa.Column('blocked_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('chat_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('blocked_recipients')
@@ -0,0 +1,38 @@
+"""add delivery priority
+
+Revision ID: b2d7f4a08c61
+Revises: a9c4e6f21d83
+Create Date: 2026-10-16 20:05:51.902147
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d7f4a08c61'
+down_revision: Union[str, Sequence[str], None] = 'a9c4e6f21d83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('broadcast_deliveries', sa.Column('priority', sa.SmallInteger(), server_default='1', nullable=False))
+    # уже стоящие в очереди напоминания и подтверждения — в срочную полосу
+    op.execute(
+        "UPDATE broadcast_deliveries SET priority = 0 WHERE broadcast_id IN "
+        "(SELECT id FROM broadcasts WHERE kind IN ('reminder', 'confirm'))"
+    )
+    op.drop_index('ix_broadcast_deliveries_status_id', table_name='broadcast_deliveries')
+    op.create_index('ix_broadcast_deliveries_status_priority_id', 'broadcast_deliveries',
+                    ['status', 'priority', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_broadcast_deliveries_status_priority_id', table_name='broadcast_deliveries')
+    op.create_index('ix_broadcast_deliveries_status_id', 'broadcast_deliveries', ['status', 'id'], unique=False)
+    op.drop_column('broadcast_deliveries', 'priority')
@@ -0,0 +1,44 @@
+"""add due items
+
+Revision ID: c5d92f1a6e08
+Revises: 8a4e1d2c7b95
+Create Date: 2026-10-16 15:02:44.118930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d92f1a6e08'
+down_revision: Union[str, Sequence[str], None] = '8a4e1d2c7b95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('due_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('due_at', sa.TIMESTAMP(timezone=True), nullable=False),
+    sa.Column('fired_at', sa.TIMESTAMP(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id', 'kind', name='uq_due_event_kind')
+    )
+    op.create_index('ix_due_items_pending_due_at', 'due_items', ['due_at'], unique=False,
+                    postgresql_where=sa.text('fired_at IS NULL'), sqlite_where=sa.text('fired_at IS NULL'))
+    # задачи событий переезжают из scheduler_jobs в due_items — при старте нужна полная сверка
+    op.execute("DELETE FROM scheduler_meta WHERE key = 'events_reconciled_at'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_due_items_pending_due_at', table_name='due_items', postgresql_where=sa.text('fired_at IS NULL'),
+                  sqlite_where=sa.text('fired_at IS NULL'))
+    op.drop_table('due_items')
+    op.execute("DELETE FROM scheduler_meta WHERE key = 'events_reconciled_at'")
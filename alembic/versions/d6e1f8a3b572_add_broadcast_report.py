@@ -0,0 +1,30 @@
+"""add broadcast report message
+
+Revision ID: d6e1f8a3b572
+Revises: b2d7f4a08c61
+Create Date: 2026-10-16 21:12:37.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6e1f8a3b572'
+down_revision: Union[str, Sequence[str], None] = 'b2d7f4a08c61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('broadcasts', sa.Column('report_chat_id', sa.String(), nullable=True))
+    op.add_column('broadcasts', sa.Column('report_message_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('broadcasts', 'report_message_id')
+    op.drop_column('broadcasts', 'report_chat_id')
@@ -0,0 +1,46 @@
+"""add hot query indexes
+
+Revision ID: e1a7b3c94f26
+Revises: c5d92f1a6e08
+Create Date: 2026-10-16 16:27:15.640182
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a7b3c94f26'
+down_revision: Union[str, Sequence[str], None] = 'c5d92f1a6e08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # registrations.event_id отдельный индекс не нужен — это префикс uq_event_tg(event_id, tg_id)
+    op.create_index('ix_events_owner_publish_at', 'events', ['owner_tg_id', 'publish_at'], unique=False)
+    op.create_index('ix_events_publish_at', 'events', ['publish_at'], unique=False)
+    op.create_index('ix_events_reminder_at', 'events', ['reminder_at'], unique=False,
+                    postgresql_where=sa.text('reminder_at IS NOT NULL'), sqlite_where=sa.text('reminder_at IS NOT NULL'))
+    op.create_index('ix_events_confirm_request_at', 'events', ['confirm_request_at'], unique=False,
+                    postgresql_where=sa.text('confirm_request_at IS NOT NULL'),
+                    sqlite_where=sa.text('confirm_request_at IS NOT NULL'))
+    # сверка планировщика смотрит только на updated_at — у старых строк он может быть пустым
+    op.execute("UPDATE events SET updated_at = created_at WHERE updated_at IS NULL")
+    op.create_index('ix_events_updated_at', 'events', ['updated_at'], unique=False)
+    op.create_index(op.f('ix_generated_links_event_id'), 'generated_links', ['event_id'], unique=False)
+    op.create_index('ix_deeplink_tokens_event_expires', 'deeplink_tokens', ['event_id', 'expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_deeplink_tokens_event_expires', table_name='deeplink_tokens')
+    op.drop_index(op.f('ix_generated_links_event_id'), table_name='generated_links')
+    op.drop_index('ix_events_updated_at', table_name='events')
+    op.drop_index('ix_events_confirm_request_at', table_name='events')
+    op.drop_index('ix_events_reminder_at', table_name='events')
+    op.drop_index('ix_events_publish_at', table_name='events')
+    op.drop_index('ix_events_owner_publish_at', table_name='events')
@@ -0,0 +1,253 @@
+"""
+Бенчмарк слоя данных: каждую функцию crud.py и utils.verify_payload вызывает --repeat раз
+на датасете из benchmarks/dataset.py и печатает число SQL-запросов и задержку на вызов.
+Прогон на датасетах разного размера (--scale) показывает, какие функции деградируют с ростом таблиц.
+
+    DATABASE_URL=sqlite+aiosqlite:///bench.db python benchmarks/crud_benchmark.py --seed-dataset --scale 0.1 -o crud-0.1.json
+    DATABASE_URL=sqlite+aiosqlite:///bench.db python benchmarks/crud_benchmark.py --baseline crud-0.1.json
+
+Каждый вызов идёт в своей сессии (как хендлер в своём апдейте), кэши перед вызовом
+сбрасываются — меряется путь до БД; --warm оставляет кэши. Пишущие функции работают
+с созданными здесь же событиями и пользователями, существующие данные почти не меняются.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, UTC
+from itertools import count
+
+os.environ.setdefault("SECRET_KEY", "crud-benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import select, func, event as sa_event
+
+import cache
+import crud
+from dataset import generate, table_sizes, tg_id, ADMINS
+from latency import percentiles
+from models import engine, AsyncSessionLocal, User, Event, Registration, DeepLinkToken, DueItem
+from utils import verify_payload, make_signed_token
+
+_unique = count(1)
+# событий в одном вызове sync_due_items_bulk
+BULK_EVENTS = 1000
+
+
+async def pick_samples(rnd: random.Random) -> dict:
+    """Ключи из датасета, на которых гоняются читающие функции."""
+    async with AsyncSessionLocal() as session:
+        n_users = await session.scalar(select(func.count()).select_from(User))
+        popular = (await session.execute(
+            select(Registration.event_id, func.count().label("n")).group_by(Registration.event_id)
+            .order_by(func.count().desc()).limit(1)
+        )).first()
+        event_ids = list((await session.execute(select(Event.id).order_by(Event.id))).scalars())
+        tokens = list((await session.execute(
+            select(DeepLinkToken.token).where(DeepLinkToken.expires_at.is_(None)).limit(1000)
+        )).scalars())
+        registered = (await session.execute(
+            select(Registration.event_id, Registration.tg_id).limit(1000)
+        )).all()
+        due_at = await session.scalar(select(func.min(DueItem.due_at)).where(DueItem.fired_at.is_(None)))
+    return {
+        "users": [tg_id(i) for i in rnd.sample(range(n_users), min(1000, n_users))],
+        "admins": [tg_id(i) for i in range(ADMINS)],
+        "events": event_ids,
+        "popular_event": popular.event_id,
+        "popular_size": popular.n,
+        "tokens": tokens,
+        "registered": registered,
+        "next_due_at": due_at,
+    }
+
+
+async def new_event(session, owner: str, days: int = 30) -> Event:
+    publish_at = datetime.now(UTC) + timedelta(days=days)
+    return await crud.create_event(session, owner, f"bench {next(_unique)}", "poster", publish_at,
+                                   publish_at + timedelta(days=1), "r", None, None, None)
+
+
+def cases(s: dict, rnd: random.Random) -> dict:
+    """Имя функции -> корутина от сессии; подготовка, которую не надо мерить, — внутри prepare."""
+    now = datetime.now(UTC)
+    user = lambda: rnd.choice(s["users"])
+    event_id = lambda: rnd.choice(s["events"])
+    admin = lambda: rnd.choice(s["admins"])
+
+    async def drain_stream(session):
+        return sum([len(chunk) async for chunk in crud.stream_recipient_ids(session, s["popular_event"])])
+
+    async def drain_iter(session):
+        return len([tg async for tg in crud.iter_recipient_ids(session, s["popular_event"])])
+
+    async def created_event(session):
+        return await new_event(session, admin())
+
+    async def sync_due(session):
+        ev = await crud.get_event(session, event_id())
+        planned = await crud.sync_due_items(session, ev, now)
+        await session.rollback()
+        return planned
+
+    async def sync_due_bulk(session):
+        # сверка планировщика на выборке событий: стоимость растёт с их числом
+        ids = rnd.sample(s["events"], min(BULK_EVENTS, len(s["events"])))
+        events = list((await session.execute(select(Event).where(Event.id.in_(ids)))).scalars())
+        planned = await crud.sync_due_items_bulk(session, events, now)
+        await session.rollback()
+        return planned
+
+    async def add_links(session):
+        await crud.add_generated_links(session, event_id(), {"join": "x", "speaker": "y"})
+        await session.commit()
+
+    async def due_item(session):
+        # сработавшее «только что» действие на собственном событии — его и забираем
+        ev = await created_event(session)
+        item = DueItem(event_id=ev.id, kind="publish", due_at=now)
+        session.add(item)
+        await session.commit()
+        return item
+
+    def reg():
+        return rnd.choice(s["registered"])
+
+    return {
+        "get_user_role": (None, lambda ss, _: crud.get_user_role(ss, admin())),
+        "get_user_by_tg": (None, lambda ss, _: crud.get_user_by_tg(ss, user())),
+        "get_user_cached": (None, lambda ss, _: crud.get_user_cached(ss, user())),
+        "create_user_if_not_exists": (None, lambda ss, _: crud.create_user_if_not_exists(
+            ss, f"bench{next(_unique)}", "bench")),
+        "create_event": (None, lambda ss, _: new_event(ss, admin())),
+        "create_event_with_links": (None, lambda ss, _: crud.create_event_with_links(
+            ss, admin(), f"bench {next(_unique)}", "poster", now + timedelta(days=30), None, None, None, None,
+            None, "meetuper", ("join", "speaker"))),
+        "update_event": (created_event, lambda ss, ev: crud.update_event(ss, ev.id, title="renamed")),
+        "delete_event": (created_event, lambda ss, ev: crud.delete_event(ss, ev.id, ev.owner_tg_id)),
+        "add_registration": (created_event, lambda ss, ev: crud.add_registration(
+            ss, ev.id, user(), "listener", "n", 30, "s", "c", None)),
+        "register_user_for_event": (created_event, lambda ss, ev: crud.register_user_for_event(
+            ss, user(), "u", ev.id, "listener", "n", 30, "s", "c", None)),
+        "mark_confirmed": (None, lambda ss, _: crud.mark_confirmed(ss, *reg())),
+        "get_event": (None, lambda ss, _: crud.get_event(ss, event_id())),
+        "get_registrations_for_event": (None, lambda ss, _: crud.get_registrations_for_event(ss, event_id())),
+        "get_registrations_for_event[popular]": (
+            None, lambda ss, _: crud.get_registrations_for_event(ss, s["popular_event"])),
+        "stream_recipient_ids[popular]": (None, lambda ss, _: drain_stream(ss)),
+        "iter_recipient_ids[popular]": (None, lambda ss, _: drain_iter(ss)),
+        "has_recipients": (None, lambda ss, _: crud.has_recipients(ss, event_id())),
+        "save_generated_link": (None, lambda ss, _: crud.save_generated_link(ss, event_id(), "join", "x")),
+        "add_generated_links": (None, lambda ss, _: add_links(ss)),
+        "get_pending_events": (None, lambda ss, _: crud.get_pending_events(ss, now)),
+        "get_events_for_scheduler": (None, lambda ss, _: crud.get_events_for_scheduler(ss, now)),
+        "get_events_changed_since": (None, lambda ss, _: crud.get_events_changed_since(ss, now - timedelta(hours=1))),
+        "get_events_by_owner": (None, lambda ss, _: crud.get_events_by_owner(ss, admin())),
+        "sync_due_items": (None, lambda ss, _: sync_due(ss)),
+        f"sync_due_items_bulk[{BULK_EVENTS}]": (None, lambda ss, _: sync_due_bulk(ss)),
+        "get_due_items": (None, lambda ss, _: crud.get_due_items(ss, now + timedelta(minutes=10), 1000)),
+        "claim_due_items": (due_item, lambda ss, item: crud.claim_due_items(ss, [item.id], now, 600.0)),
+        "complete_due_items": (due_item, lambda ss, item: crud.complete_due_items(ss, [item.id], now)),
+        "suppress_recipients": (None, lambda ss, _: suppress(ss, {user(): "blocked"})),
+        "unsuppress_recipient": (None, lambda ss, _: crud.unsuppress_recipient(ss, user())),
+        "filter_suppressed": (None, lambda ss, _: crud.filter_suppressed(ss, rnd.sample(s["users"], 100))),
+        "verify_payload[db]": (None, lambda ss, _: verify_payload(rnd.choice(s["tokens"]), ss)),
+        "verify_payload[signed]": (None, lambda ss, _: verify_payload(make_signed_token("join", event_id()), ss)),
+    }
+
+
+async def suppress(session, blocked: dict):
+    await crud.suppress_recipients(session, blocked)
+    await session.commit()
+
+
+def summarize(latencies: list[float], queries: list[int]) -> dict:
+    p = percentiles(latencies, digits=3)
+    return {"calls": p["n"], "queries_per_call": round(sum(queries) / len(queries), 2),
+            "p50_ms": p["p50"], "p95_ms": p["p95"], "max_ms": p["max"]}
+
+
+async def run(args) -> dict:
+    rnd = random.Random(args.seed)
+    samples = await pick_samples(rnd)
+    queries = 0
+
+    def count_query(*_):
+        nonlocal queries
+        queries += 1
+
+    results = {}
+    sa_event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+    try:
+        for name, (prepare, call) in cases(samples, rnd).items():
+            if args.only and not any(part in name for part in args.only.split(",")):
+                continue
+            latencies, per_call = [], []
+            for _ in range(args.repeat):
+                async with AsyncSessionLocal() as session:
+                    prepared = await prepare(session) if prepare else None
+                if not args.warm:
+                    for c in (cache.payload_cache, cache.event_cache, cache.user_cache):
+                        c.clear()
+                async with AsyncSessionLocal() as session:
+                    before = queries
+                    started = time.perf_counter()
+                    await call(session, prepared)
+                    latencies.append(time.perf_counter() - started)
+                    per_call.append(queries - before)
+            results[name] = summarize(latencies, per_call)
+            r = results[name]
+            print(f"{name:40} {r['queries_per_call']:>6} q  p50 {r['p50_ms']:>9} ms  p95 {r['p95_ms']:>9} ms")
+    finally:
+        sa_event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+    return {"popular_event_registrations": samples["popular_size"], "results": results}
+
+
+def compare(baseline: dict, report: dict):
+    print(f"\nrows {baseline['tables']} -> {report['tables']}")
+    for name, r in report["results"].items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        ratio = r["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        flag = "  <-- degrades" if ratio >= 3 else ""
+        print(f"{name:40} p50 {old['p50_ms']:>9} -> {r['p50_ms']:>9} ms (x{ratio:.1f}), "
+              f"queries {old['queries_per_call']} -> {r['queries_per_call']}{flag}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seed-dataset", action="store_true", help="сначала сгенерировать датасет (пустая база)")
+    parser.add_argument("--scale", type=float, default=1.0, help="объём датасета для --seed-dataset")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warm", action="store_true", help="не сбрасывать кэши между вызовами")
+    parser.add_argument("--only", help="только функции, в имени которых есть одна из подстрок через запятую")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", help="записать результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона (например, на меньшем датасете)")
+    args = parser.parse_args()
+
+    try:
+        if args.seed_dataset:
+            await generate(args.scale, args.seed)
+        report = {"database": engine.dialect.name, "tables": await table_sizes(), "repeat": args.repeat,
+                  "warm": args.warm}
+        report.update(await run(args))
+    finally:
+        await engine.dispose()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
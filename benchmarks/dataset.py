@@ -0,0 +1,172 @@
+"""
+Генератор синтетического датасета реалистичного объёма: 100k пользователей, 10k событий,
+1M регистраций, 1M deep-link токенов (плюс ссылки, due_items и немного blocked_recipients).
+--scale пропорционально уменьшает всё, например 0.01 — для быстрого прогона.
+
+    DATABASE_URL=postgresql+asyncpg://.../meetuper_bench python benchmarks/dataset.py
+    DATABASE_URL=sqlite+aiosqlite:///bench.db python benchmarks/dataset.py --scale 0.1
+
+Регистрации распределены по событиям неравномерно (закон Ципфа): у нескольких событий
+десятки тысяч участников, у большинства — десятки. Запускать на пустой базе.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, UTC
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, select, func
+
+from models import (
+    engine, init_db, AsyncSessionLocal, User, Event, Registration, GeneratedLink, DeepLinkToken,
+    DueItem, BlockedRecipient,
+)
+
+USERS = 100_000
+EVENTS = 10_000
+REGISTRATIONS = 1_000_000
+TOKENS = 1_000_000
+ADMINS = 200
+FIRST_TG_ID = 10_000_000
+CHUNK = 10_000
+
+
+def tg_id(i: int) -> str:
+    return str(FIRST_TG_ID + i)
+
+
+def registration_counts(n_events: int, total: int, max_per_event: int, rnd: random.Random) -> list[int]:
+    """Число регистраций на событие по Ципфу (s=0.8), популярные события в случайном порядке."""
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(n_events)]
+    rnd.shuffle(weights)
+    norm = total / sum(weights)
+    return [min(max_per_event, max(1, round(w * norm))) for w in weights]
+
+
+async def insert_rows(model, rows, label: str):
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        batch = []
+        n = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= CHUNK:
+                await session.execute(insert(model), batch)
+                n += len(batch)
+                batch = []
+        if batch:
+            await session.execute(insert(model), batch)
+            n += len(batch)
+        await session.commit()
+    print(f"{label:>20}: {n:>9} rows in {time.perf_counter() - started:.1f}s")
+    return n
+
+
+async def generate(scale: float = 1.0, seed: int = 42):
+    rnd = random.Random(seed)
+    now = datetime.now(UTC)
+    n_users = max(ADMINS + 1, int(USERS * scale))
+    n_events = max(1, int(EVENTS * scale))
+    n_regs = int(REGISTRATIONS * scale)
+    n_tokens = int(TOKENS * scale)
+
+    await init_db()
+    await insert_rows(User, (
+        {"tg_id": tg_id(i), "tg_username": f"user{i}", "name": f"User {i}",
+         "role": "event_admin" if i < ADMINS else "user"}
+        for i in range(n_users)
+    ), "users")
+
+    def events():
+        for i in range(n_events):
+            publish_at = now + timedelta(minutes=rnd.randint(-180 * 1440, 180 * 1440))
+            yield {
+                "owner_tg_id": tg_id(rnd.randrange(ADMINS)), "title": f"Event {i}", "poster_text": "Афиша " * 20,
+                "publish_at": publish_at,
+                "reminder_at": publish_at + timedelta(days=1) if rnd.random() < 0.7 else None,
+                "reminder_text": "Напоминание",
+                "confirm_request_at": publish_at + timedelta(days=2) if rnd.random() < 0.5 else None,
+                "confirm_text": "Подтвердите участие",
+                "updated_at": now - timedelta(minutes=rnd.randint(0, 30 * 1440)),
+            }
+
+    await insert_rows(Event, events(), "events")
+    async with AsyncSessionLocal() as session:
+        event_rows = (await session.execute(
+            select(Event.id, Event.publish_at, Event.reminder_at, Event.confirm_request_at).order_by(Event.id)
+        )).all()
+    event_ids = [row.id for row in event_rows]
+
+    counts = registration_counts(len(event_ids), n_regs, n_users, rnd)
+
+    def registrations():
+        for event_id, k in zip(event_ids, counts):
+            for i in rnd.sample(range(n_users), k):
+                speaker = rnd.random() < 0.05
+                yield {
+                    "event_id": event_id, "tg_id": tg_id(i), "role_in_event": "speaker" if speaker else "listener",
+                    "name": f"User {i}", "age": rnd.randint(18, 60), "specialty": "backend", "company": "ACME",
+                    "talk_topic": "Доклад" if speaker else None, "confirmed": rnd.random() < 0.3,
+                }
+
+    await insert_rows(Registration, registrations(), "registrations")
+
+    def tokens():
+        for n in range(n_tokens):
+            roll = rnd.random()
+            expires_at = None if roll < 0.3 else now + timedelta(days=rnd.randint(-60, 60))
+            yield {
+                "token": f"{rnd.getrandbits(128):032x}", "kind": rnd.choice(("join", "join", "speaker", "confirm")),
+                "event_id": event_ids[n % len(event_ids)],
+                "expires_at": expires_at.replace(tzinfo=None) if expires_at else None,
+            }
+
+    await insert_rows(DeepLinkToken, tokens(), "deeplink_tokens")
+    await insert_rows(GeneratedLink, (
+        {"event_id": event_id, "kind": kind, "payload": f"https://t.me/meetuper_bot?start={event_id}{kind}"}
+        for event_id in event_ids for kind in ("join", "speaker")
+    ), "generated_links")
+
+    def due_items():
+        for row in event_rows:
+            for kind, due_at in (("publish", row.publish_at), ("reminder", row.reminder_at),
+                                 ("confirm", row.confirm_request_at)):
+                if due_at is None:
+                    continue
+                due_at = due_at if due_at.tzinfo else due_at.replace(tzinfo=UTC)
+                yield {"event_id": row.id, "kind": kind, "due_at": due_at, "fired_at": due_at if due_at <= now else None}
+
+    await insert_rows(DueItem, due_items(), "due_items")
+    await insert_rows(BlockedRecipient, (
+        {"chat_id": tg_id(i), "reason": "blocked"} for i in rnd.sample(range(n_users), n_users // 100)
+    ), "blocked_recipients")
+
+
+async def table_sizes() -> dict[str, int]:
+    """Число строк в таблицах датасета — бенчмарк пишет его рядом с результатами."""
+    sizes = {}
+    async with AsyncSessionLocal() as session:
+        for model in (User, Event, Registration, DeepLinkToken, GeneratedLink, DueItem, BlockedRecipient):
+            sizes[model.__tablename__] = await session.scalar(select(func.count()).select_from(model))
+    return sizes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="доля от полного объёма")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    try:
+        await generate(args.scale, args.seed)
+        print(f"done in {time.perf_counter() - started:.1f}s: {await table_sizes()}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
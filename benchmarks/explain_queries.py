@@ -0,0 +1,164 @@
+"""
+Проверка планов горячих запросов: засеивает БД синтетикой, снимает EXPLAIN и падает
+(exit code 1), если по "горячей" таблице идёт полный проход вместо индекса.
+
+Запускать на отдельной (пустой) базе — таблицы создаются через init_db, данные не удаляются:
+
+    DATABASE_URL=postgresql+asyncpg://.../meetuper_explain python benchmarks/explain_queries.py
+    DATABASE_URL=sqlite+aiosqlite:///explain.db python benchmarks/explain_queries.py --events 500
+
+На Postgres перед EXPLAIN выключается enable_seqscan: на маленьких таблицах планировщик
+честно выбирает Seq Scan, а нас интересует, есть ли вообще пригодный индекс.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+from datetime import datetime, timedelta, UTC
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, insert, func, text
+
+from crud import (
+    events_for_scheduler_query, events_changed_since_query, events_by_owner_query,
+    recipient_ids_query, due_items_query,
+)
+from models import (
+    engine, init_db, AsyncSessionLocal, User, Event, Registration, GeneratedLink, DeepLinkToken,
+    DueItem, Broadcast, BroadcastDelivery,
+)
+
+HOT_TABLES = ("users", "events", "registrations", "generated_links", "deeplink_tokens",
+              "due_items", "broadcast_deliveries", "blocked_recipients")
+
+
+def explain_sql(statement, dialect) -> str:
+    # параметры подставляются литералами — план строится ровно для этого запроса
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    return ("EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN ") + sql
+
+
+def hot_queries(now: datetime) -> dict:
+    owner = "100"
+    return {
+        "events_for_scheduler": events_for_scheduler_query(now),
+        "events_changed_since": events_changed_since_query(now - timedelta(minutes=5)),
+        "events_by_owner": events_by_owner_query(owner, upcoming=True, now=now),
+        "recipient_ids": recipient_ids_query(1).order_by(Registration.tg_id),
+        "recipient_ids_by_role": recipient_ids_query(1, "speaker"),
+        "registration_lookup": select(Registration.id).where(Registration.event_id == 1, Registration.tg_id == owner),
+        "user_by_tg": select(User).where(User.tg_id == owner),
+        "links_by_event": select(GeneratedLink).where(GeneratedLink.event_id == 1),
+        "tokens_by_event": select(DeepLinkToken).where(DeepLinkToken.event_id == 1, DeepLinkToken.expires_at > now),
+        "due_items": due_items_query(now + timedelta(minutes=10), 1000),
+        "outbox_pending": (
+            select(BroadcastDelivery.id).where(
+                BroadcastDelivery.priority == 1, BroadcastDelivery.status == "pending",
+                BroadcastDelivery.broadcast_id.in_(select(Broadcast.id).where(Broadcast.status == "pending")),
+            )
+            .order_by(BroadcastDelivery.id).limit(100)
+        ),
+        "broadcast_progress": (
+            select(BroadcastDelivery.status, func.count())
+            .where(BroadcastDelivery.broadcast_id == 1).group_by(BroadcastDelivery.status)
+        ),
+    }
+
+
+def full_scans(dialect: str, plan: list[str]) -> list[str]:
+    """Полные проходы по горячим таблицам в плане."""
+    found = []
+    for line in plan:
+        if dialect == "sqlite":
+            m = re.match(r"\s*SCAN (\w+)", line)
+            if m and "INDEX" not in line:
+                found.append(m.group(1))
+        else:
+            m = re.search(r"Seq Scan on (\w+)", line)
+            if m:
+                found.append(m.group(1))
+    return [t for t in found if t in HOT_TABLES]
+
+
+async def seed(n_users: int, n_events: int, regs_per_event: int, now: datetime):
+    rnd = random.Random(42)
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(User), [{"tg_id": str(100 + i), "role": "user"} for i in range(n_users)])
+        events = []
+        for i in range(n_events):
+            publish_at = now + timedelta(hours=rnd.randint(-24 * 30, 24 * 30))
+            events.append({
+                "owner_tg_id": str(100 + rnd.randrange(min(n_users, 50))),
+                "title": f"event {i}", "poster_text": "poster",
+                "publish_at": publish_at,
+                "reminder_at": publish_at + timedelta(days=1) if rnd.random() < 0.3 else None,
+                "confirm_request_at": publish_at + timedelta(days=2) if rnd.random() < 0.2 else None,
+                "created_at": now - timedelta(days=60), "updated_at": now - timedelta(days=60),
+            })
+        await session.execute(insert(Event), events)
+        await session.flush()
+        event_ids = list((await session.execute(select(Event.id))).scalars())
+
+        regs, links, tokens, due = [], [], [], []
+        for event_id in event_ids:
+            for tg in rnd.sample(range(n_users), min(regs_per_event, n_users)):
+                regs.append({"event_id": event_id, "tg_id": str(100 + tg), "name": "n",
+                             "role_in_event": "speaker" if rnd.random() < 0.1 else "listener"})
+            links.append({"event_id": event_id, "kind": "join", "payload": "x"})
+            tokens.append({"token": f"{event_id:032x}", "kind": "join", "event_id": event_id,
+                           "expires_at": (now + timedelta(days=7)).replace(tzinfo=None)})
+            due.append({"event_id": event_id, "kind": "publish", "due_at": now + timedelta(minutes=rnd.randint(-600, 600)),
+                        "fired_at": now if rnd.random() < 0.5 else None})
+        for rows, model in ((regs, Registration), (links, GeneratedLink), (tokens, DeepLinkToken), (due, DueItem)):
+            for i in range(0, len(rows), 5000):
+                await session.execute(insert(model), rows[i:i + 5000])
+
+        bc = Broadcast(kind="manual", text="hi")
+        session.add(bc)
+        await session.flush()
+        await session.execute(insert(BroadcastDelivery), [
+            {"broadcast_id": bc.id, "chat_id": str(100 + i), "status": "sent" if i % 10 else "pending"}
+            for i in range(n_users)
+        ])
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--regs-per-event", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="база уже засеяна")
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать планы целиком")
+    args = parser.parse_args()
+
+    now = datetime.now(UTC)
+    await init_db()
+    if not args.no_seed:
+        await seed(args.users, args.events, args.regs_per_event, now)
+
+    dialect = engine.dialect.name
+    failures = 0
+    async with AsyncSessionLocal() as session:
+        await session.execute(text("ANALYZE"))
+        if dialect == "postgresql":
+            await session.execute(text("SET enable_seqscan = off"))
+        for name, stmt in hot_queries(now).items():
+            rows = (await session.execute(text(explain_sql(stmt, engine.dialect)))).all()
+            plan = [str(r[-1]) for r in rows]
+            scans = full_scans(dialect, plan)
+            status = "FAIL" if scans else "ok"
+            failures += bool(scans)
+            print(f"{status:4} {name}" + (f" — full scan on {', '.join(scans)}" if scans else ""))
+            if args.verbose or scans:
+                for line in plan:
+                    print("       " + line)
+    await engine.dispose()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+"""
+Локальная замена Telegram Bot API для бенчмарков: принимает запросы aiogram
+(/bot<token>/<method>), отвечает с заданной задержкой и умеет ломаться как настоящий —
+429 с retry_after, 403 для заблокировавших бота, 5xx.
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 40 --rate-429 0.001 --blocked 0.02
+
+Бот направляется на него через AiohttpSession(api=TelegramAPIServer.from_base(url)),
+см. make_bot(). Счётчики ответов — GET /stats.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field, asdict
+
+from aiohttp import web
+
+_MESSAGE_METHODS = ("sendmessage", "editmessagetext", "sendphoto")
+
+
+@dataclass
+class FakeApiConfig:
+    latency_ms: float = 30.0        # средняя задержка ответа
+    jitter_ms: float = 10.0         # равномерный разброс +-jitter
+    rate_429: float = 0.0           # доля случайных 429
+    retry_after: int = 1            # retry_after в 429
+    blocked: float = 0.0            # доля получателей, заблокировавших бота (403), детерминированно по chat_id
+    rate_5xx: float = 0.0           # доля случайных 500/502
+    server_rate: float = 0.0        # глобальный лимит сообщений в секунду (0 — без лимита), сверх — 429
+    seed: int = 42
+
+
+@dataclass
+class FakeApiStats:
+    requests: int = 0
+    ok: int = 0
+    rate_limited: int = 0
+    blocked: int = 0
+    server_errors: int = 0
+    by_method: dict = field(default_factory=dict)
+
+
+class FakeBotAPI:
+    """aiohttp-приложение, изображающее Bot API. start()/stop() — для запуска в том же процессе."""
+    def __init__(self, config: FakeApiConfig | None = None):
+        self.config = config or FakeApiConfig()
+        self.stats = FakeApiStats()
+        self._random = random.Random(self.config.seed)
+        self._message_ids = 0
+        # окно текущей секунды для server_rate
+        self._window_started = 0.0
+        self._window_count = 0
+        self._runner: web.AppRunner | None = None
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/stats", self.handle_stats)
+
+    def is_blocked(self, chat_id) -> bool:
+        if not self.config.blocked:
+            return False
+        try:
+            key = int(chat_id)
+        except (TypeError, ValueError):
+            return False
+        return (key * 2654435761) % 10_000 < self.config.blocked * 10_000
+
+    def _over_server_rate(self) -> bool:
+        if not self.config.server_rate:
+            return False
+        now = time.monotonic()
+        if now - self._window_started >= 1.0:
+            self._window_started, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count > self.config.server_rate
+
+    def _error(self, code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def _result(self, method: str, params: dict):
+        chat_id = params.get("chat_id")
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        if method in _MESSAGE_METHODS:
+            self._message_ids += 1
+            try:
+                chat_id = int(chat_id)
+            except (TypeError, ValueError):
+                pass
+            return {
+                "message_id": int(params.get("message_id") or self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        cfg = self.config
+        self.stats.requests += 1
+        self.stats.by_method[method] = self.stats.by_method.get(method, 0) + 1
+
+        delay = cfg.latency_ms + self._random.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if method in _MESSAGE_METHODS:
+            if self._over_server_rate() or self._random.random() < cfg.rate_429:
+                self.stats.rate_limited += 1
+                return self._error(429, f"Too Many Requests: retry after {cfg.retry_after}",
+                                   retry_after=cfg.retry_after)
+            if self.is_blocked(params.get("chat_id")):
+                self.stats.blocked += 1
+                return self._error(403, "Forbidden: bot was blocked by the user")
+            if self._random.random() < cfg.rate_5xx:
+                self.stats.server_errors += 1
+                return self._error(self._random.choice((500, 502)), "Internal Server Error")
+        self.stats.ok += 1
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(asdict(self.stats))
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Поднять сервер и вернуть базовый URL (port=0 — свободный порт)."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def make_bot(base_url: str, token: str = "123456:FAKE-TOKEN", limit: int = 1000, timeout: float = 30.0):
+    """Bot, отправляющий запросы на фейковый API; limit — размер пула соединений."""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url), limit=limit)
+    session.timeout = timeout
+    return Bot(token, session=session)
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeApiConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--rate-429", type=float, default=defaults.rate_429, help="доля случайных 429")
+    parser.add_argument("--retry-after", type=int, default=defaults.retry_after)
+    parser.add_argument("--blocked", type=float, default=defaults.blocked, help="доля заблокировавших бота")
+    parser.add_argument("--rate-5xx", type=float, default=defaults.rate_5xx, help="доля ответов 500/502")
+    parser.add_argument("--server-rate", type=float, default=defaults.server_rate,
+                        help="сообщений в секунду до 429 (0 — без лимита)")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeApiConfig:
+    return FakeApiConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                         retry_after=args.retry_after, blocked=args.blocked, rate_5xx=args.rate_5xx,
+                         server_rate=args.server_rate, seed=args.seed)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(config_from_args(args))
+    url = await api.start(args.host, args.port)
+    print(f"Fake Bot API on {url} ({json.dumps(asdict(api.config))})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
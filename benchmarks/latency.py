@@ -0,0 +1,21 @@
+"""Перцентили задержек — одна реализация на все бенчмарки, чтобы их отчёты были сравнимы."""
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Значение квантиля q (nearest rank) по уже отсортированному списку; пустой — 0."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def percentiles(values: list[float], digits: int = 2) -> dict:
+    """n, p50/p95/p99 и max задержек в миллисекундах (values — в секундах); пустой список — {}."""
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def ms(value: float) -> float:
+        return round(value * 1000, digits)
+
+    return {"n": len(values), "p50": ms(percentile(values, 0.50)), "p95": ms(percentile(values, 0.95)),
+            "p99": ms(percentile(values, 0.99)), "max": ms(values[-1])}
@@ -0,0 +1,158 @@
+"""
+Пропускная способность Mailer на фейковом Bot API (benchmarks/fake_bot_api.py): для каждого
+размера аудитории — сообщений в секунду, p50/p99 задержки запроса и общее время.
+Результаты пишутся в JSON вместе с коммитом, --baseline сравнивает с прошлым прогоном.
+
+    python benchmarks/mailer_benchmark.py --sizes 1000,10000,100000 -o mailer.json
+    python benchmarks/mailer_benchmark.py --rate-429 0.001 --blocked 0.02 --baseline mailer.json -o new.json
+    python benchmarks/mailer_benchmark.py --api-url http://127.0.0.1:8081  # сервер в отдельном процессе
+
+Лимитер по умолчанию глобально почти не ограничивает (--global-rate), иначе мерился бы
+лимит Telegram в 30 сообщений/с, а не сам Mailer. Каждый получатель — отдельный личный чат.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from datetime import datetime, UTC
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from fake_bot_api import FakeBotAPI, FakeApiStats, add_config_arguments, config_from_args, make_bot
+from latency import percentile
+from mailer import Mailer, SendStats
+from ratelimiter import TelegramRateLimiter
+
+
+class RequestTimer(BaseRequestMiddleware):
+    """Время каждого запроса к API на стороне клиента (вместе с ожиданием соединения из пула)."""
+    def __init__(self):
+        self.latencies: list[float] = []
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_one(base_url: str, size: int, args, api: FakeBotAPI | None = None) -> dict:
+    bot = make_bot(base_url, limit=args.connections)
+    timer = RequestTimer()
+    bot.session.middleware(timer)
+    limiter = TelegramRateLimiter(global_rate=args.global_rate)
+    mailer = Mailer(bot, concurrency=args.concurrency, base_delay=args.base_delay, limiter=limiter,
+                    adaptive=args.adaptive, max_concurrency=args.max_concurrency)
+    chat_ids = range(1_000_000, 1_000_000 + size)
+    stats = SendStats()
+    try:
+        started = time.perf_counter()
+        if args.method == "stream":
+            stats = await mailer.send_stream(chat_ids, "benchmark")
+        else:
+            await mailer.send_batch(list(chat_ids), "benchmark", stats=stats)
+        wall = time.perf_counter() - started
+    finally:
+        await bot.session.close()
+
+    latencies = sorted(timer.latencies)
+    return {
+        "recipients": size,
+        "wall_s": round(wall, 3),
+        "msgs_per_s": round(size / wall, 1),
+        "requests": len(latencies),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "stats": stats.as_dict(),
+        "final_window": mailer.window_size,
+        "fake_api": asdict(api.stats) if api else None,
+    }
+
+
+def compare(baseline: dict, results: list[dict]):
+    before = {r["recipients"]: r for r in baseline.get("results", [])}
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'}:")
+    for r in results:
+        old = before.get(r["recipients"])
+        if not old:
+            continue
+        change = (r["msgs_per_s"] - old["msgs_per_s"]) / old["msgs_per_s"] * 100
+        print(f"  {r['recipients']:>7}: {old['msgs_per_s']:>9} -> {r['msgs_per_s']:>9} msg/s ({change:+.1f}%), "
+              f"p99 {old['latency_ms']['p99']} -> {r['latency_ms']['p99']} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры аудитории через запятую")
+    parser.add_argument("--method", choices=("batch", "stream"), default="batch",
+                        help="send_batch (задача на получателя) или send_stream (пул воркеров)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--adaptive", action="store_true", help="AIMD-окно вместо фиксированного")
+    parser.add_argument("--max-concurrency", type=int, default=100)
+    parser.add_argument("--base-delay", type=float, default=0.05, help="бэкоф Mailer'а при 5xx")
+    parser.add_argument("--global-rate", type=float, default=1_000_000.0, help="глобальный лимит лимитера, msg/s")
+    parser.add_argument("--connections", type=int, default=1000, help="размер пула соединений aiohttp")
+    parser.add_argument("--api-url", help="уже запущенный fake_bot_api.py; иначе поднимается в этом процессе")
+    parser.add_argument("-o", "--output", default="mailer_benchmark.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--log-level", default="ERROR", help="предупреждения Mailer'а о каждом 403 шумят")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    api = None
+    base_url = args.api_url
+    if not base_url:
+        api = FakeBotAPI(config_from_args(args))
+        base_url = await api.start()
+
+    results = []
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            if api:
+                api.stats = FakeApiStats()
+            result = await run_one(base_url, size, args, api)
+            results.append(result)
+            print(f"{size:>7} recipients: {result['msgs_per_s']:>9} msg/s, wall {result['wall_s']} s, "
+                  f"p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms, {result['stats']}")
+    finally:
+        if api:
+            await api.stop()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(UTC).isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+"""
+Нагрузка на регистрацию: тысячи синтетических пользователей одновременно приходят по ссылке
+/start <token> и проходят сценарий слушателя или докладчика целиком через dp.feed_update —
+с теми же middleware, хендлерами и FSM-хранилищем, что у бота; ответы уходят в fake_bot_api.
+Печатает апдейтов в секунду, перцентили задержки по шагам и запросы к БД на одну регистрацию.
+
+    DATABASE_URL=sqlite+aiosqlite:///load.db python benchmarks/registration_load.py --users 2000
+    DATABASE_URL=postgresql+asyncpg://.../meetuper_load python benchmarks/registration_load.py \\
+        --users 5000 --concurrency 1000 --speakers 0.1 -o registration.json
+
+    DATABASE_URL=sqlite+aiosqlite:///load.db python benchmarks/registration_load.py \\
+        --rate-limit --global-rate 100000 --max-start-wait-ms 50  # ответы на /start не ждут лимитер
+
+Так выглядит всплеск сразу после публикации афиши. Событие и ссылки создаются через
+create_event_with_links, как у админа; на каждый прогон — новое событие. FSM-хранилище
+выбирается как у бота (FSM_STORAGE). --rate-limit включает лимитер ответов, как в проде, —
+тогда упираемся в лимиты Telegram, а не в сам бот.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta, UTC
+from contextvars import ContextVar
+from itertools import count
+
+# бот при импорте требует токен и секрет; Bot API здесь фейковый
+os.environ.setdefault("BOT_TOKEN", "123456:FAKE-TOKEN")
+os.environ.setdefault("SECRET_KEY", "registration-load")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.types import Update
+from sqlalchemy import select, func, event as sa_event
+
+from crud import create_event_with_links
+from fake_bot_api import FakeBotAPI, add_config_arguments, config_from_args, make_bot
+from latency import percentiles
+from main import dp
+from middlewares import RateLimitRequestMiddleware
+from models import engine, init_db, AsyncSessionLocal, Registration
+from ratelimiter import TelegramRateLimiter
+
+LISTENER_STEPS = (("start", None), ("name", "Иван"), ("age", "30"), ("specialty", "backend"), ("company", "-"))
+SPEAKER_STEPS = (("start", None), ("name", "Мария"), ("age", "35"), ("specialty", "SRE"),
+                 ("company", "ACME"), ("topic", "Бот под нагрузкой"))
+
+_update_ids = count(1)
+
+
+# шаг сценария, к которому относится текущий ответ бота
+current_step: ContextVar[str] = ContextVar("current_step", default="-")
+
+
+class TimedRateLimiter(TelegramRateLimiter):
+    """Лимитер, запоминающий по шагам сценария, сколько каждый ответ ждал токена."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits: dict[str, list[float]] = {}
+
+    async def acquire(self, chat_id, priority: str = "bulk"):
+        started = time.perf_counter()
+        await super().acquire(chat_id, priority)
+        self.waits.setdefault(current_step.get(), []).append(time.perf_counter() - started)
+
+
+def make_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+async def create_event() -> tuple[int, dict[str, str]]:
+    async with AsyncSessionLocal() as session:
+        ev, links = await create_event_with_links(
+            session, owner_tg_id="1", title="Load test", poster_text="Афиша",
+            publish_at=datetime.now(UTC) + timedelta(days=7),
+            reminder_at=None, reminder_text=None, confirm_request_at=None, confirm_text=None,
+            category_id=None, bot_username=os.getenv("BOT_USERNAME", "meetuper_bot"),
+        )
+    # ссылка вида https://t.me/<bot>?start=<token>
+    return ev.id, {kind: link.rsplit("start=", 1)[-1] for kind, link in links.items()}
+
+
+async def run(args) -> dict:
+    await init_db()
+    event_id, tokens = await create_event()
+
+    api = FakeBotAPI(config_from_args(args))
+    bot = make_bot(await api.start())
+    limiter = None
+    if args.rate_limit:
+        limiter = TimedRateLimiter(global_rate=args.global_rate)
+        bot.session.middleware(RateLimitRequestMiddleware(limiter))
+
+    step_latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    slots = asyncio.Semaphore(args.concurrency or args.users)
+    speaker_every = round(1 / args.speakers) if args.speakers else 0
+
+    async def walk(user_id: int, steps, token: str):
+        async with slots:
+            for step, text in steps:
+                update = Update.model_validate(make_update(user_id, f"/start {token}" if step == "start" else text),
+                                               context={"bot": bot})
+                current_step.set(step)
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    return
+                finally:
+                    step_latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    users = []
+    for i in range(args.users):
+        speaker = speaker_every and i % speaker_every == 0
+        users.append(walk(args.first_user_id + i, SPEAKER_STEPS if speaker else LISTENER_STEPS,
+                          tokens["speaker" if speaker else "join"]))
+
+    queries = 0
+
+    def count_query(*_):
+        nonlocal queries
+        queries += 1
+
+    sa_event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*users)
+        wall = time.perf_counter() - started
+    finally:
+        sa_event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+        await bot.session.close()
+        await api.stop()
+
+    async with AsyncSessionLocal() as session:
+        completed = await session.scalar(
+            select(func.count()).select_from(Registration).where(Registration.event_id == event_id)
+        )
+    updates = sum(len(v) for v in step_latencies.values())
+    return {
+        "database": engine.dialect.name,
+        "fsm_storage": type(dp.storage).__name__,
+        "users": args.users,
+        "concurrency": args.concurrency or args.users,
+        "completed_registrations": completed,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "updates": updates,
+        "updates_per_s": round(updates / wall, 1),
+        "db_queries": queries,
+        "db_queries_per_registration": round(queries / completed, 2) if completed else None,
+        "api_requests": api.stats.requests,
+        "step_latency_ms": {step: percentiles(values) for step, values in step_latencies.items()},
+        # шаги пользователя идут без пауз на ввод, поэтому дальше /start упираются в лимит чата
+        "limiter_wait_ms": {step: percentiles(v) for step, v in limiter.waits.items()} if limiter else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("-c", "--concurrency", type=int, default=0, help="пользователей одновременно (0 — все сразу)")
+    parser.add_argument("--speakers", type=float, default=0.1, help="доля докладчиков")
+    parser.add_argument("--first-user-id", type=int, default=5_000_000)
+    parser.add_argument("--rate-limit", action="store_true", help="лимитер ответов, как у бота в проде")
+    parser.add_argument("--global-rate", type=float, default=30.0, help="глобальный лимит лимитера при --rate-limit")
+    parser.add_argument("--max-start-wait-ms", type=float,
+                        help="при --rate-limit завершиться с ошибкой, если ответ на /start ждал лимитер дольше")
+    parser.add_argument("-o", "--output", help="записать результат в JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.set_defaults(latency_ms=20.0, jitter_ms=5.0)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    try:
+        report = await run(args)
+    finally:
+        await engine.dispose()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    waited = (report["limiter_wait_ms"] or {}).get("start", {}).get("max", 0.0)
+    if args.max_start_wait_ms is not None and waited > args.max_start_wait_ms:
+        sys.exit(f"/start replies waited for the rate limiter up to {waited} ms (limit {args.max_start_wait_ms} ms)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
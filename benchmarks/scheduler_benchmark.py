@@ -0,0 +1,270 @@
+"""
+Масштаб планировщика: N событий с датами публикации, напоминания и подтверждения, init_scheduler
+и schedule_event_jobs_for_event над ними, затем DueDispatcher на виртуальных часах.
+Печатает время старта (холодного и повторного), резидентную память и точность срабатывания
+при всплеске одновременно наступивших действий.
+
+    DATABASE_URL=sqlite+aiosqlite:///sched.db python benchmarks/scheduler_benchmark.py --events 100000 -o sched.json
+    DATABASE_URL=sqlite+aiosqlite:///sched2.db python benchmarks/scheduler_benchmark.py --baseline sched.json
+
+Виртуальные часы идут вместе с реальными, но ожидания диспетчера проматывают мгновенно:
+часы и дни между срабатываниями не ждём, а время на запросы к БД и хендлеры остаётся в задержке.
+Хендлеры не шлют сообщений, а «работают» --handler-ms. Запускать на пустой базе.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timedelta, UTC
+
+os.environ.setdefault("SECRET_KEY", "scheduler-benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import select, delete
+
+from crud import create_user_if_not_exists, get_event
+from dataset import insert_rows
+from due_dispatcher import DueDispatcher
+from jobstore import PersistentJobStore
+from latency import percentiles
+from models import engine, init_db, AsyncSessionLocal, Event, DueItem, SchedulerMeta
+from scheduler import init_scheduler, schedule_event_jobs_for_event, EVENT_JOBS, RECONCILE_MARKER
+
+OWNER = "1"
+
+
+class VirtualClock:
+    """
+    Время, которое идёт вместе с реальным, а sleep() проматывает мгновенно — но только
+    когда idle() дождался запущенной работы: пока хендлеры работают, время реальное.
+    """
+    def __init__(self, start: datetime, idle=None):
+        self.start = start
+        self.idle = idle
+        self.skipped = 0.0
+        self._anchor = time.perf_counter()
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=time.perf_counter() - self._anchor + self.skipped)
+
+    async def sleep(self, seconds: float):
+        if self.idle is not None:
+            await self.idle()
+        self.skipped += seconds
+        await asyncio.sleep(0)
+
+
+def rss_mb() -> float:
+    """Текущая резидентная память процесса; без /proc — пиковая."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def load_events(args, base: datetime, burst_at: datetime) -> int:
+    """args.events событий: первые args.burst публикуются ровно в burst_at, остальные — в пределах --spread-days."""
+    rnd = random.Random(args.seed)
+    async with AsyncSessionLocal() as session:
+        await create_user_if_not_exists(session, OWNER, "bench_owner", "event_admin")
+    spread = int(args.spread_days * 86400)
+
+    def events():
+        for i in range(args.events):
+            if i < args.burst:
+                publish_at = burst_at
+            else:
+                publish_at = base + timedelta(seconds=rnd.randint(2 * 3600, max(2 * 3600, spread)))
+            yield {
+                "owner_tg_id": OWNER, "title": f"Event {i}", "poster_text": "Афиша",
+                "publish_at": publish_at,
+                "reminder_at": publish_at + timedelta(days=1) if rnd.random() < 0.7 else None,
+                "reminder_text": "Напоминание",
+                "confirm_request_at": publish_at + timedelta(days=2) if rnd.random() < 0.5 else None,
+                "confirm_text": "Подтвердите участие",
+            }
+
+    return await insert_rows(Event, events(), "events")
+
+
+async def timed_init(scheduler, jobstore) -> float:
+    started = time.perf_counter()
+    await init_scheduler(scheduler, jobstore)
+    return round(time.perf_counter() - started, 3)
+
+
+async def time_reschedule(sample: int) -> dict:
+    """schedule_event_jobs_for_event на случайных событиях — путь «админ поменял даты»."""
+    async with AsyncSessionLocal() as session:
+        ids = list((await session.execute(select(Event.id).order_by(Event.id))).scalars())
+    latencies = []
+    for event_id in random.Random(0).sample(ids, min(sample, len(ids))):
+        async with AsyncSessionLocal() as session:
+            ev = await get_event(session, event_id)
+            started = time.perf_counter()
+            await schedule_event_jobs_for_event(ev, session)
+            latencies.append(time.perf_counter() - started)
+    return percentiles(latencies)
+
+
+async def dispatch(args, start: datetime, until: datetime) -> dict:
+    """Гоняет DueDispatcher на виртуальных часах от start до until; задержка — от due_at до вызова хендлера."""
+    clock = VirtualClock(start)
+    fired_at: dict[tuple[int, str], datetime] = {}
+
+    def handler(kind: str):
+        async def run(event_id: int):
+            fired_at[(event_id, kind)] = clock.now()
+            if args.handler_ms:
+                await asyncio.sleep(args.handler_ms / 1000)
+        run.__name__ = EVENT_JOBS[kind].__name__
+        return run
+
+    dispatcher = DueDispatcher({kind: handler(kind) for kind in EVENT_JOBS}, horizon=args.horizon,
+                               max_items=args.max_items, batch_size=args.batch_size,
+                               poll_interval=args.poll_interval, concurrency=args.concurrency,
+                               clock=clock.now, sleep=clock.sleep)
+    clock.idle = dispatcher.join
+    max_heap = steps = 0
+    started = time.perf_counter()
+    while clock.now() < until:
+        await dispatcher.step()
+        steps += 1
+        max_heap = max(max_heap, len(dispatcher._heap))
+    await dispatcher.join()
+    wall = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(
+            select(DueItem.event_id, DueItem.kind, DueItem.due_at).where(DueItem.fired_at.is_not(None))
+        )).all()
+        expected = len((await session.execute(
+            select(DueItem.id).where(DueItem.due_at <= until)
+        )).all())
+
+    burst_lag, other_lag = [], []
+    burst_at = start + timedelta(seconds=args.burst_in)
+    for event_id, kind, due_at in rows:
+        due_at = due_at if due_at.tzinfo else due_at.replace(tzinfo=UTC)
+        fired = fired_at.get((event_id, kind))
+        if fired is None:
+            continue
+        (burst_lag if due_at == burst_at else other_lag).append((fired - due_at).total_seconds())
+    last = max(burst_lag) if burst_lag else 0.0
+    return {
+        "simulated_s": round((until - start).total_seconds()),
+        "wall_s": round(wall, 3),
+        "steps": steps,
+        "due": expected,
+        "fired": dispatcher.fired,
+        "misfired": dispatcher.misfired,
+        "max_heap": max_heap,
+        "burst_lag_ms": percentiles(burst_lag),
+        "burst_drain_s": round(last, 3),
+        "other_lag_ms": percentiles(other_lag),
+    }
+
+
+def compare(baseline: dict, report: dict):
+    print(f"\ncompared with {baseline['events']} events:")
+    for path in (("startup_s", "cold"), ("startup_s", "warm"), ("rss_mb", "after_init"), ("rss_mb", "peak"),
+                 ("dispatch", "burst_drain_s"), ("dispatch", "burst_lag_ms", "p99")):
+        old, new = baseline, report
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if old is None or new is None:
+            continue
+        ratio = new / old if old else float("inf")
+        flag = "  <-- regression" if ratio >= 1.5 else ""
+        print(f"  {'.'.join(path):28} {old:>10} -> {new:>10} (x{ratio:.2f}){flag}")
+
+
+async def run(args) -> dict:
+    await init_db()
+    # бенчмарк всегда меряет полный холодный проход
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(SchedulerMeta).where(SchedulerMeta.key == RECONCILE_MARKER))
+        await session.commit()
+
+    base = datetime.now(UTC).replace(microsecond=0)
+    burst_at = base + timedelta(seconds=args.burst_in)
+    await load_events(args, base, burst_at)
+
+    jobstore = PersistentJobStore()
+    scheduler = AsyncIOScheduler(timezone="UTC", jobstores={"default": jobstore})
+    rss_before = rss_mb()
+    cold = await timed_init(scheduler, jobstore)
+    rss_after = rss_mb()
+    # повторный старт: маркер сверки уже есть, изменённых событий нет
+    warm = await timed_init(scheduler, jobstore)
+    reschedule = await time_reschedule(args.sample)
+
+    # виртуальное время начинается с момента создания событий, а не после загрузки
+    dispatched = await dispatch(args, base, burst_at + timedelta(seconds=args.run_after))
+    await jobstore.close()
+    return {
+        "database": engine.dialect.name,
+        "events": args.events,
+        "burst": args.burst,
+        "startup_s": {"cold": cold, "warm": warm},
+        "schedule_event_jobs_ms": reschedule,
+        "rss_mb": {"before_init": rss_before, "after_init": rss_after, "after_dispatch": rss_mb(),
+                   "peak": peak_rss_mb()},
+        "dispatch": dispatched,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--burst", type=int, default=1000, help="событий с публикацией в одну и ту же секунду")
+    parser.add_argument("--burst-in", type=float, default=3600.0, help="через сколько секунд после старта всплеск")
+    parser.add_argument("--run-after", type=float, default=600.0, help="сколько виртуальных секунд гнать после всплеска")
+    parser.add_argument("--spread-days", type=float, default=180.0, help="остальные публикации — в пределах этого срока")
+    parser.add_argument("--handler-ms", type=float, default=5.0, help="время работы одного хендлера")
+    parser.add_argument("--sample", type=int, default=200, help="вызовов schedule_event_jobs_for_event")
+    parser.add_argument("--horizon", type=float, default=600.0)
+    parser.add_argument("--max-items", type=int, default=10_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=20, help="хендлеров диспетчера одновременно")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("-o", "--output", help="записать результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    try:
+        report = await run(args)
+    finally:
+        await engine.dispose()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Нагрузочный прогон вебхука: шлёт синтетические апдейты (сообщения от разных пользователей)
+POST-запросами на запущенный бот и печатает задержку ответа и пропускную способность.
+
+    BOT_MODE=webhook WEBHOOK_SECRET=test python main.py
+    python benchmarks/webhook_harness.py --url http://127.0.0.1:8080/webhook --secret test -n 2000 -c 50
+
+Бот отвечает до обработки апдейта, поэтому здесь меряется именно время ответа Telegram'у;
+обработка идёт в фоне (ответы бота упрутся в Bot API, если токен ненастоящий).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from itertools import count
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import ClientSession
+
+from latency import percentiles
+
+_update_ids = count(1)
+
+
+def make_update(user_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100, help="число разных отправителей")
+    parser.add_argument("--text", default="/start")
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(make_update(10_000 + i % args.users, args.text))
+
+    async def worker(session: ClientSession):
+        while not queue.empty():
+            update = queue.get_nowait()
+            started = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as resp:
+                await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(args.requests / elapsed, 1),
+        "statuses": statuses,
+        "latency_ms": percentiles(latencies),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
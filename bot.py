@@ -5,6 +5,8 @@ from aiogram.client.default import DefaultBotProperties
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 
+from jobstore import PersistentJobStore
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -20,4 +22,10 @@ bot = Bot(
     token=BOT_TOKEN,
     default=DefaultBotProperties(parse_mode="HTML")
 )
-scheduler = AsyncIOScheduler(timezone="UTC")
+jobstore = PersistentJobStore()
+scheduler = AsyncIOScheduler(
+    timezone="UTC",
+    jobstores={"default": jobstore},
+    # задачи, пропущенные за время простоя, догоняем, если опоздали не больше чем на час
+    job_defaults={"misfire_grace_time": 3600, "coalesce": True},
+)
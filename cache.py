@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+# маркер промаха, чтобы можно было кэшировать None
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Внутрипроцессный кэш: LRU-вытеснение при превышении maxsize и TTL на каждую запись.
+    Считает hits/misses/evictions/expired — см. stats().
+    В нескольких репликах инвалидация локальна, устаревание ограничено TTL.
+    """
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires = item
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        for key in [k for k, (v, _) in self._data.items() if predicate(k, v)]:
+            del self._data[key]
+
+    def purge(self) -> int:
+        """Удалить истёкшие записи (get удаляет их лениво). Возвращает число удалённых."""
+        now = time.monotonic()
+        expired = [k for k, (_, expires) in self._data.items() if expires <= now]
+        for key in expired:
+            del self._data[key]
+        self.expired += len(expired)
+        return len(expired)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# payload'ы deep-link токенов (verify_payload), строки Event (get_event) и User (get_user_cached)
+payload_cache = TTLCache("deeplink_payload", maxsize=4096, ttl=300.0)
+event_cache = TTLCache("event", maxsize=1024, ttl=60.0)
+user_cache = TTLCache("user", maxsize=4096, ttl=60.0)
+
+
+CACHES = (payload_cache, event_cache, user_cache)
+
+
+def stats() -> dict[str, dict]:
+    return {c.name: c.stats() for c in CACHES}
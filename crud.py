@@ -1,9 +1,22 @@
-from datetime import datetime
-from typing import Optional, Sequence
-from sqlalchemy import select, update
+from datetime import datetime, timedelta, UTC
+from typing import Optional, Sequence, AsyncIterator, Iterable
+from sqlalchemy import select, update, insert, delete, exists, or_, Select, func
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import User, Event, Registration, GeneratedLink
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from cache import event_cache, user_cache, MISSING
+from models import User, Event, Registration, GeneratedLink, DueItem, BlockedRecipient
+from utils import make_deeplinks, invalidate_event_payloads
+
+
+def _upsert(session: AsyncSession, model):
+    """INSERT с ON CONFLICT для диалекта текущей сессии (Postgres / SQLite)."""
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise ValueError(f"upsert is not supported for dialect {dialect!r} (only postgresql and sqlite)")
 
 
 async def get_user_role(session: AsyncSession, tg_id: str) -> str:
@@ -16,14 +29,57 @@ async def get_user_by_tg(session: AsyncSession, tg_id: str) -> Optional[User]:
     return q.scalars().first()
 
 
-async def create_user_if_not_exists(session: AsyncSession, tg_id: str, tg_username: Optional[str]=None, role: str="user"):
+async def get_user_cached(session: AsyncSession, tg_id: str) -> Optional[User]:
+    """get_user_by_tg через user_cache; отсутствие пользователя тоже кэшируется."""
+    cached = user_cache.get(tg_id, MISSING)
+    if cached is None:
+        return None
+    if cached is not MISSING:
+        return await session.merge(cached, load=False)
     user = await get_user_by_tg(session, tg_id)
-    if user:
-        return user
-    user = User(tg_id=tg_id, tg_username=tg_username, role=role)
-    session.add(user)
+    user_cache.set(tg_id, _snapshot(user) if user else None)
+    return user
+
+
+async def _upsert_user(session: AsyncSession, tg_id: str, tg_username: Optional[str], role: str) -> User:
+    stmt = _upsert(session, User).values(tg_id=tg_id, tg_username=tg_username, role=role)
+    # DO UPDATE (а не DO NOTHING), чтобы RETURNING вернул и уже существующую строку; роль не трогаем
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={"tg_username": func.coalesce(stmt.excluded.tg_username, User.tg_username)},
+    ).returning(User)
+    # user_cache сбрасывает вызывающий — после commit, иначе параллельный get_user_cached
+    # успеет закэшировать строку до нашей транзакции
+    q = await session.execute(stmt, execution_options={"populate_existing": True})
+    return q.scalar_one()
+
+
+async def _upsert_registration(session: AsyncSession, event_id: int, tg_id: str, role_in_event: str,
+                               name: str, age: Optional[int], specialty: Optional[str],
+                               company: Optional[str], talk_topic: Optional[str]) -> Registration:
+    stmt = _upsert(session, Registration).values(
+        event_id=event_id,
+        tg_id=tg_id,
+        role_in_event=role_in_event,
+        name=name,
+        age=age,
+        specialty=specialty,
+        company=company,
+        talk_topic=talk_topic
+    )
+    # уже зарегистрирован — обновим существующую запись
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Registration.event_id, Registration.tg_id],
+        set_={k: stmt.excluded[k] for k in ("name", "age", "specialty", "company", "talk_topic")},
+    ).returning(Registration)
+    q = await session.execute(stmt, execution_options={"populate_existing": True})
+    return q.scalar_one()
+
+
+async def create_user_if_not_exists(session: AsyncSession, tg_id: str, tg_username: Optional[str]=None, role: str="user"):
+    user = await _upsert_user(session, tg_id, tg_username, role)
     await session.commit()
-    await session.refresh(user)
+    user_cache.invalidate(tg_id)
     return user
 
 
@@ -48,6 +104,35 @@ async def create_event(session: AsyncSession, owner_tg_id: str, title: str, post
     return ev
 
 
+async def create_event_with_links(session: AsyncSession, owner_tg_id: str, title: str, poster_text: str,
+                                  publish_at: datetime, reminder_at: Optional[datetime],
+                                  reminder_text: Optional[str], confirm_request_at: Optional[datetime],
+                                  confirm_text: Optional[str], category_id: Optional[int],
+                                  bot_username: str, kinds=("join", "speaker")) -> tuple[Event, dict[str, str]]:
+    """
+    Событие + его DeepLinkToken + GeneratedLink одной транзакцией:
+    INSERT события и по одному multi-row INSERT на токены и ссылки, один commit.
+    """
+    ev = Event(
+        owner_tg_id=owner_tg_id,
+        title=title,
+        poster_text=poster_text,
+        publish_at=publish_at,
+        reminder_at=reminder_at,
+        reminder_text=reminder_text,
+        confirm_request_at=confirm_request_at,
+        confirm_text=confirm_text,
+        category_id=category_id
+    )
+    session.add(ev)
+    await session.flush()
+
+    links = await make_deeplinks(kinds, ev.id, bot_username, session)
+    await add_generated_links(session, ev.id, links)
+    await session.commit()
+    return ev, links
+
+
 async def update_event(session, event_id: int, **kwargs):
     result = await session.execute(
         select(Event).where(Event.id == event_id)
@@ -58,6 +143,7 @@ async def update_event(session, event_id: int, **kwargs):
     for k, v in kwargs.items():
         setattr(ev, k, v)
     await session.commit()
+    event_cache.invalidate(event_id)
     return ev
 
 
@@ -70,58 +156,61 @@ async def delete_event(session, event_id: int, owner_tg_id: str) -> bool:
         return False
     await session.delete(ev)
     await session.commit()
+    event_cache.invalidate(event_id)
+    invalidate_event_payloads(event_id)
     return True
 
 
 async def add_registration(session: AsyncSession, event_id: int, tg_id: str, role_in_event: str,
                            name: str, age: Optional[int], specialty: Optional[str],
                            company: Optional[str], talk_topic: Optional[str]) -> Registration:
-    reg = Registration(
-        event_id=event_id,
-        tg_id=tg_id,
-        role_in_event=role_in_event,
-        name=name,
-        age=age,
-        specialty=specialty,
-        company=company,
-        talk_topic=talk_topic
-    )
-    session.add(reg)
-    try:
-        await session.commit()
-    except IntegrityError:
-        await session.rollback()
-        # уже зарегистрирован — обновим существующую запись
-        q = await session.execute(select(Registration).where(Registration.event_id == event_id, Registration.tg_id == tg_id))
-        existing = q.scalars().first()
-        if existing:
-            existing.name = name
-            existing.age = age
-            existing.specialty = specialty
-            existing.company = company
-            existing.talk_topic = talk_topic
-            session.add(existing)
-            await session.commit()
-            return existing
-        raise
-    await session.refresh(reg)
+    reg = await _upsert_registration(session, event_id, tg_id, role_in_event, name, age, specialty, company, talk_topic)
+    await session.commit()
+    return reg
+
+
+async def register_user_for_event(session: AsyncSession, tg_id: str, tg_username: Optional[str],
+                                  event_id: int, role_in_event: str, name: str, age: Optional[int],
+                                  specialty: Optional[str], company: Optional[str],
+                                  talk_topic: Optional[str]) -> Registration:
+    """Завершение регистрации: upsert пользователя и upsert регистрации в одной транзакции."""
+    await _upsert_user(session, tg_id, tg_username, "user")
+    reg = await _upsert_registration(session, event_id, tg_id, role_in_event, name, age, specialty, company, talk_topic)
+    await session.commit()
+    user_cache.invalidate(tg_id)
     return reg
 
 
 async def mark_confirmed(session: AsyncSession, event_id: int, tg_id: str) -> bool:
-    q = await session.execute(select(Registration).where(Registration.event_id == event_id, Registration.tg_id == tg_id))
-    reg = q.scalars().first()
-    if not reg:
-        return False
-    reg.confirmed = True
-    session.add(reg)
+    q = await session.execute(
+        update(Registration)
+        .where(Registration.event_id == event_id, Registration.tg_id == tg_id)
+        .values(confirmed=True)
+        .returning(Registration.id)
+    )
+    confirmed = q.first() is not None
     await session.commit()
-    return True
+    return confirmed
+
+
+def _snapshot(obj):
+    """Отвязанная от сессии копия колонок ORM-объекта — её и храним в кэше."""
+    mapper = obj.__mapper__
+    copy = mapper.class_(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
 
 
 async def get_event(session: AsyncSession, event_id: int) -> Optional[Event]:
+    cached = event_cache.get(event_id)
+    if cached is not None:
+        # merge(load=False) кладёт копию в текущую сессию без SQL
+        return await session.merge(cached, load=False)
     q = await session.execute(select(Event).where(Event.id == event_id))
-    return q.scalars().first()
+    ev = q.scalars().first()
+    if ev is not None:
+        event_cache.set(event_id, _snapshot(ev))
+    return ev
 
 
 async def get_registrations_for_event(session: AsyncSession, event_id: int, role_filter: Optional[str]=None) -> Sequence[Registration]:
@@ -132,6 +221,48 @@ async def get_registrations_for_event(session: AsyncSession, event_id: int, role
     return q.scalars().all()
 
 
+def recipient_ids_query(event_id: int, role_filter: Optional[str]=None) -> Select:
+    """
+    SELECT только tg_id зарегистрированных — покрывается индексом uq_event_tg(event_id, tg_id).
+    Заблокировавшие бота (blocked_recipients) исключаются анти-джойном по первичному ключу.
+    """
+    stmt = select(Registration.tg_id).where(
+        Registration.event_id == event_id,
+        ~exists().where(BlockedRecipient.chat_id == Registration.tg_id),
+    )
+    if role_filter in ("listener", "speaker"):
+        stmt = stmt.where(Registration.role_in_event == role_filter)
+    return stmt
+
+
+async def has_recipients(session: AsyncSession, event_id: int, role_filter: Optional[str]=None) -> bool:
+    """Есть ли кому слать рассылку события — EXISTS по тому же запросу, без выборки id."""
+    return bool(await session.scalar(select(recipient_ids_query(event_id, role_filter).exists())))
+
+
+async def stream_recipient_ids(session: AsyncSession, event_id: int, role_filter: Optional[str]=None,
+                               chunk_size: int = 1000, after_tg_id: Optional[str]=None) -> AsyncIterator[list[str]]:
+    """
+    Стримит tg_id получателей чанками через серверный курсор, без ORM-объектов.
+    Порядок — по tg_id, поэтому after_tg_id (последний обработанный id) продолжает
+    выборку с того же места (keyset pagination).
+    """
+    stmt = recipient_ids_query(event_id, role_filter).order_by(Registration.tg_id)
+    if after_tg_id is not None:
+        stmt = stmt.where(Registration.tg_id > after_tg_id)
+    result = await session.stream(stmt.execution_options(yield_per=chunk_size))
+    async for chunk in result.scalars().partitions():
+        yield list(chunk)
+
+
+async def iter_recipient_ids(session: AsyncSession, event_id: int, role_filter: Optional[str]=None,
+                             chunk_size: int = 1000) -> AsyncIterator[str]:
+    """То же по одному id — удобно отдавать прямо в Mailer.send_stream."""
+    async for chunk in stream_recipient_ids(session, event_id, role_filter, chunk_size):
+        for tg_id in chunk:
+            yield tg_id
+
+
 async def save_generated_link(session: AsyncSession, event_id: int, kind: str, payload: str, expires_at: Optional[datetime]=None):
     gl = GeneratedLink(event_id=event_id, kind=kind, payload=payload, expires_at=expires_at)
     session.add(gl)
@@ -140,26 +271,176 @@ async def save_generated_link(session: AsyncSession, event_id: int, kind: str, p
     return gl
 
 
+async def add_generated_links(session: AsyncSession, event_id: int, links: dict[str, str]):
+    """GeneratedLink для {kind: ссылка} одним multi-row INSERT; не коммитит."""
+    await session.execute(insert(GeneratedLink), [
+        {"event_id": event_id, "kind": kind, "payload": link} for kind, link in links.items()
+    ])
+
+
 async def get_pending_events(session: AsyncSession, now: datetime) -> Sequence[Event]:
     q = await session.execute(select(Event).where(Event.publish_at >= now))
     return q.scalars().all()
 
 
+def events_for_scheduler_query(now: datetime) -> Select:
+    """События с будущей публикацией/напоминанием/подтверждением (BitmapOr по индексам дат)."""
+    return select(Event).where(
+        (Event.publish_at >= now) |
+        (Event.reminder_at.is_not(None) & (Event.reminder_at >= now)) |
+        (Event.confirm_request_at.is_not(None) & (Event.confirm_request_at >= now))
+    )
+
+
 async def get_events_for_scheduler(session: AsyncSession, now: datetime):
     # load all events that have future publish/reminder/confirm dates
-    q = await session.execute(
-        select(Event).where(
-            (Event.publish_at >= now) |
-            (Event.reminder_at is not None and Event.reminder_at >= now) |
-            (Event.confirm_request_at is not None and Event.confirm_request_at >= now)
-        )
-    )
+    q = await session.execute(events_for_scheduler_query(now))
     return q.scalars().all()
 
 
-async def get_events_by_owner(session, owner_tg_id: str, upcoming: bool = True):
+def events_changed_since_query(since: datetime) -> Select:
+    # updated_at проставляется и при создании, поэтому хватает одного индекса ix_events_updated_at
+    return select(Event).where(Event.updated_at > since)
+
+
+async def get_events_changed_since(session: AsyncSession, since: datetime) -> Sequence[Event]:
+    """События, созданные или изменённые после since — для инкрементальной сверки планировщика."""
+    q = await session.execute(events_changed_since_query(since))
+    return q.scalars().all()
+
+
+def events_by_owner_query(owner_tg_id: str, upcoming: bool = True, now: Optional[datetime] = None) -> Select:
+    now = now or datetime.now(UTC)
     stmt = select(Event).where(Event.owner_tg_id == owner_tg_id)
-    stmt = stmt.where(Event.publish_at >= datetime.now()) if upcoming else stmt.where(Event.publish_at < datetime.now())
-    stmt = stmt.order_by(Event.publish_at.desc())
-    result = await session.execute(stmt)
+    stmt = stmt.where(Event.publish_at >= now) if upcoming else stmt.where(Event.publish_at < now)
+    return stmt.order_by(Event.publish_at.desc())
+
+
+async def get_events_by_owner(session, owner_tg_id: str, upcoming: bool = True):
+    result = await session.execute(events_by_owner_query(owner_tg_id, upcoming))
     return result.scalars().all()
+
+
+# kind действия -> поле события с его датой
+DUE_KINDS = {"publish": "publish_at", "reminder": "reminder_at", "confirm": "confirm_request_at"}
+
+
+# строк в одном многострочном INSERT ... ON CONFLICT (по 3 параметра на строку)
+DUE_ITEMS_CHUNK = 500
+
+
+async def sync_due_items(session: AsyncSession, ev: Event, now: datetime) -> int:
+    """
+    Приводит due_items события в соответствие с его датами (не коммитит).
+    Будущие даты — upsert со сбросом fired_at, пустые/прошедшие — удаляем ещё не сработавшие.
+    """
+    return await sync_due_items_bulk(session, [ev], now)
+
+
+async def sync_due_items_bulk(session: AsyncSession, events: Iterable[Event], now: datetime) -> int:
+    """
+    То же для многих событий сразу (сверка планировщика, не коммитит): строки собираются
+    за один проход и пишутся пачками по DUE_ITEMS_CHUNK — многострочным upsert,
+    а не запросом на событие.
+    """
+    planned: list[dict] = []
+    dropped: dict[str, list[int]] = {kind: [] for kind in DUE_KINDS}
+    for ev in events:
+        for kind, attr in DUE_KINDS.items():
+            due_at = getattr(ev, attr)
+            if due_at is not None and due_at.tzinfo is None:
+                due_at = due_at.replace(tzinfo=UTC)
+            if due_at is None or due_at <= now:
+                dropped[kind].append(ev.id)
+            else:
+                planned.append({"event_id": ev.id, "kind": kind, "due_at": due_at})
+    for kind, event_ids in dropped.items():
+        for i in range(0, len(event_ids), DUE_ITEMS_CHUNK):
+            await session.execute(delete(DueItem).where(
+                DueItem.event_id.in_(event_ids[i:i + DUE_ITEMS_CHUNK]), DueItem.kind == kind,
+                DueItem.fired_at.is_(None),
+            ))
+    for i in range(0, len(planned), DUE_ITEMS_CHUNK):
+        stmt = _upsert(session, DueItem).values(planned[i:i + DUE_ITEMS_CHUNK])
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[DueItem.event_id, DueItem.kind],
+            set_={"due_at": stmt.excluded.due_at, "claimed_at": None, "fired_at": None},
+        ))
+    return len(planned)
+
+
+def due_items_query(until: datetime, limit: int) -> Select:
+    """Ближайшие несработавшие действия до until — по частичному индексу ix_due_items_pending_due_at."""
+    return (
+        select(DueItem.id, DueItem.event_id, DueItem.kind, DueItem.due_at)
+        .where(DueItem.fired_at.is_(None), DueItem.due_at <= until)
+        .order_by(DueItem.due_at)
+        .limit(limit)
+    )
+
+
+async def get_due_items(session: AsyncSession, until: datetime, limit: int):
+    q = await session.execute(due_items_query(until, limit))
+    return q.all()
+
+
+async def claim_due_items(session: AsyncSession, ids: Sequence[int], now: datetime, lease: float):
+    """
+    Атомарно берёт действия в работу на lease секунд; возвращает только те, что удалось забрать.
+    Действие, чья аренда истекла без complete_due_items (процесс упал, хендлер бросил
+    исключение), забирается снова.
+    """
+    q = await session.execute(
+        update(DueItem)
+        .where(DueItem.id.in_(ids), DueItem.fired_at.is_(None), DueItem.due_at <= now,
+               or_(DueItem.claimed_at.is_(None), DueItem.claimed_at <= now - timedelta(seconds=lease)))
+        .values(claimed_at=now)
+        .returning(DueItem.id, DueItem.event_id, DueItem.kind, DueItem.due_at)
+        .execution_options(synchronize_session=False)
+    )
+    rows = q.all()
+    await session.commit()
+    return rows
+
+
+async def complete_due_items(session: AsyncSession, ids: Sequence[int], now: datetime):
+    """Пометить действия исполненными — после того, как хендлер отработал."""
+    await session.execute(
+        update(DueItem)
+        .where(DueItem.id.in_(ids), DueItem.fired_at.is_(None))
+        .values(fired_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+
+
+async def suppress_recipients(session: AsyncSession, blocked: dict[str, str]):
+    """Запомнить недоступных получателей (chat_id -> reason). Не коммитит."""
+    if not blocked:
+        return
+    stmt = _upsert(session, BlockedRecipient).values(
+        [{"chat_id": chat_id, "reason": reason} for chat_id, reason in blocked.items()]
+    )
+    await session.execute(stmt.on_conflict_do_nothing(index_elements=[BlockedRecipient.chat_id]))
+
+
+async def unsuppress_recipient(session: AsyncSession, chat_id: str) -> bool:
+    """
+    Пользователь снова написал боту — убрать из blocked_recipients.
+    Сначала EXISTS по первичному ключу: обычный /start не пишет в БД и не держит
+    транзакцию (а на SQLite — блокировку записи), пока хендлер ждёт ответов Bot API.
+    """
+    if not await session.scalar(select(exists().where(BlockedRecipient.chat_id == chat_id))):
+        return False
+    result = await session.execute(delete(BlockedRecipient).where(BlockedRecipient.chat_id == chat_id))
+    await session.commit()
+    return bool(result.rowcount)
+
+
+async def filter_suppressed(session: AsyncSession, chat_ids: Sequence[str]) -> list[str]:
+    """Убрать из явного списка получателей тех, кто в blocked_recipients."""
+    if not chat_ids:
+        return []
+    q = await session.execute(select(BlockedRecipient.chat_id).where(BlockedRecipient.chat_id.in_(chat_ids)))
+    blocked = set(q.scalars())
+    return [c for c in chat_ids if c not in blocked]
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta, UTC
+from typing import Awaitable, Callable, Mapping, Optional
+
+from crud import get_due_items, claim_due_items, complete_due_items
+from metrics import SCHEDULER_LAG_SECONDS
+from models import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# будим диспетчер после изменения дат события, не дожидаясь poll_interval
+_wakeup = asyncio.Event()
+
+
+def notify():
+    _wakeup.set()
+
+
+class DueDispatcher:
+    """
+    Срабатывание запланированных действий событий из таблицы due_items.
+    В памяти держится только скользящий горизонт (ближайшие horizon секунд, не больше max_items)
+    в виде min-heap по due_at; он пополняется индексированным запросом "следующие к исполнению",
+    так что память не зависит от числа запланированных событий.
+    Перед запуском действие атомарно берётся в аренду (claimed_at) на lease секунд — при
+    нескольких процессах его исполняет один, а fired_at ставится только после успешного
+    хендлера. Если процесс упал или хендлер бросил исключение, действие заберут снова,
+    когда аренда истечёт (но не позже misfire_grace). Хендлеры идут отдельными задачами,
+    не больше concurrency одновременно, и не задерживают цикл диспетчера.
+    clock/sleep можно подменить (виртуальное время в бенчмарках).
+    """
+    def __init__(self, handlers: Mapping[str, Callable[[int], Awaitable]], horizon: float = 600.0,
+                 max_items: int = 10000, batch_size: int = 100, poll_interval: float = 30.0,
+                 misfire_grace: float = 3600.0, lease: float = 600.0, concurrency: int = 20,
+                 clock: Optional[Callable[[], datetime]] = None,
+                 sleep: Optional[Callable[[float], Awaitable]] = None):
+        self.handlers = handlers
+        self.horizon = timedelta(seconds=horizon)
+        self.max_items = max_items
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.misfire_grace = timedelta(seconds=misfire_grace)
+        self.lease = lease
+        self._slots = asyncio.Semaphore(concurrency)
+        self._running: set[asyncio.Task] = set()
+        self._completed: list[int] = []
+        self._flusher: asyncio.Task | None = None
+        self.clock = clock or (lambda: datetime.now(UTC))
+        self.sleep = sleep
+        self._heap: list[tuple[datetime, int, int, str]] = []
+        self._refill_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+        self.fired = 0
+        self.misfired = 0
+
+    @staticmethod
+    def _aware(dt: datetime) -> datetime:
+        # SQLite отдаёт naive-даты — храним их в UTC
+        return dt if dt.tzinfo else dt.replace(tzinfo=UTC)
+
+    async def refill(self):
+        """Перечитать горизонт из БД: таблица — источник истины, heap строится заново."""
+        now = self.clock()
+        until = now + self.horizon
+        async with AsyncSessionLocal() as session:
+            rows = await get_due_items(session, until, self.max_items)
+        self._heap = [(self._aware(r.due_at), r.id, r.event_id, r.kind) for r in rows]
+        heapq.heapify(self._heap)
+        # если упёрлись в max_items, горизонт покрыт только до последнего загруженного действия
+        covered = self._aware(rows[-1].due_at) if len(rows) >= self.max_items else until
+        self._refill_at = min(covered, now + timedelta(seconds=self.poll_interval))
+
+    async def fire_due(self) -> int:
+        """Забрать наступившие действия пачками по batch_size и запустить их хендлеры задачами."""
+        now = self.clock()
+        claimed_total = 0
+        while self._heap and self._heap[0][0] <= now:
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._heap))
+            async with AsyncSessionLocal() as session:
+                claimed = await claim_due_items(session, [item[1] for item in batch], now, self.lease)
+            for row in claimed:
+                self._spawn(self._run(row, now))
+            claimed_total += len(claimed)
+        return claimed_total
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return task
+
+    def _complete(self, row):
+        """Отметить fired_at; отметки копятся и пишутся одним UPDATE, пока предыдущий идёт."""
+        self._completed.append(row.id)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = self._spawn(self._flush_completed())
+
+    async def _flush_completed(self):
+        while self._completed:
+            ids, self._completed = self._completed, []
+            try:
+                async with AsyncSessionLocal() as session:
+                    await complete_due_items(session, ids, self.clock())
+            except Exception:
+                # хендлеры уже отработали; без отметки действия повторятся после аренды
+                logger.exception("Failed to mark %s due items as fired", len(ids))
+
+    async def _run(self, row, now: datetime):
+        due_at = self._aware(row.due_at)
+        if now - due_at > self.misfire_grace:
+            self.misfired += 1
+            logger.warning("Skipping %s of event %s: missed by %s", row.kind, row.event_id, now - due_at)
+            self._complete(row)
+            return
+        handler = self.handlers.get(row.kind)
+        if handler is None:
+            logger.error("No handler for due item kind %s", row.kind)
+            self._complete(row)
+            return
+        async with self._slots:
+            SCHEDULER_LAG_SECONDS.observe(max((self.clock() - due_at).total_seconds(), 0.0), handler.__name__)
+            try:
+                await handler(row.event_id)
+            except Exception:
+                # fired_at не ставим: действие заберут снова, когда истечёт аренда
+                logger.exception("Due item %s of event %s failed, will retry in %ss",
+                                 row.kind, row.event_id, self.lease)
+                return
+        self.fired += 1
+        self._complete(row)
+
+    async def join(self):
+        """Дождаться запущенных хендлеров и записи их отметок."""
+        while self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _wait(self, timeout: float):
+        if self.sleep is not None:
+            await self.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def step(self):
+        """Одна итерация: при необходимости пополнить горизонт, исполнить наступившее, подождать."""
+        if _wakeup.is_set() or self._refill_at is None or self.clock() >= self._refill_at:
+            _wakeup.clear()
+            await self.refill()
+        await self.fire_due()
+        now = self.clock()
+        wake_at = self._refill_at
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        await self._wait(max((wake_at - now).total_seconds(), 0.0))
+
+    async def run(self):
+        logger.info("Due dispatcher started (horizon %s, max %s items)", self.horizon, self.max_items)
+        while True:
+            try:
+                await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Due dispatcher iteration failed")
+                await self._wait(self.poll_interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # уже взятые действия доисполняем, иначе они ждали бы конца аренды
+        await self.join()
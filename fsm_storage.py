@@ -0,0 +1,233 @@
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, UTC
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import select, delete
+
+from cache import TTLCache, MISSING
+from crud import _upsert
+from models import AsyncSessionLocal, FsmState
+
+logger = logging.getLogger(__name__)
+
+# состояние FSM текущего апдейта внутри SQLAlchemyStorage.batch(): прочитанное и изменённое
+_batch: ContextVar[Optional["_Batch"]] = ContextVar("fsm_batch", default=None)
+
+
+class _Batch:
+    def __init__(self):
+        self.records: dict[str, tuple[Optional[str], dict]] = {}
+        self.dirty: set[str] = set()
+
+
+class _Encoder(json.JSONEncoder):
+    # в данных FSM лежат datetime (даты события в CreateEventSG) — сохраняем их с тегом
+    def default(self, o):
+        if isinstance(o, datetime):
+            return {"__dt__": o.isoformat()}
+        return super().default(o)
+
+
+def _decode(obj: dict):
+    if len(obj) == 1 and "__dt__" in obj:
+        return datetime.fromisoformat(obj["__dt__"])
+    return obj
+
+
+def dumps(data: Mapping[str, Any]) -> str:
+    return json.dumps(data, cls=_Encoder, ensure_ascii=False)
+
+
+def loads(raw: str) -> Dict[str, Any]:
+    return json.loads(raw, object_hook=_decode)
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_states на общем движке — переживает рестарт
+    и не привязывает пользователя к одному процессу.
+
+    Внутри batch() (его открывает FsmBatchMiddleware на каждый апдейт) записи копятся
+    и сбрасываются одним upsert'ом при выходе из апдейта: update_data + set_state одного
+    шага хендлера превращаются в одну запись в БД, и к концу апдейта она уже закоммичена.
+    Вне batch() запись идёт в БД сразу. Ключ читается из БД один раз за апдейт, между
+    апдейтами не кэшируется — соседняя реплика видит шаг, закоммиченный на другой.
+    read_ttl > 0 включает кэш чтений между апдейтами — только для одной реплики.
+    Пустое состояние (state.clear()) удаляет строку, незавершённые сценарии истекают
+    через ttl и периодически вычищаются.
+    """
+    def __init__(self, key_builder: Optional[KeyBuilder] = None, ttl: float = 7 * 24 * 3600,
+                 read_ttl: float = 0.0, purge_interval: float = 600.0, session_factory=AsyncSessionLocal):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.ttl = timedelta(seconds=ttl)
+        self.purge_interval = purge_interval
+        self.session_factory = session_factory
+        self._records = TTLCache("fsm_records", maxsize=4096, ttl=read_ttl) if read_ttl > 0 else None
+        self._last_purge = 0.0
+        self.writes = 0
+        self.flushes = 0
+
+    @asynccontextmanager
+    async def batch(self):
+        """Копить записи до выхода из блока и записать их одной транзакцией; при исключении — не писать."""
+        batch = _Batch()
+        token = _batch.set(batch)
+        try:
+            yield
+        finally:
+            _batch.reset(token)
+        await self.flush({key: batch.records[key] for key in batch.dirty})
+
+    async def _load(self, key: str) -> tuple[Optional[str], dict]:
+        batch = _batch.get()
+        if batch is not None and key in batch.records:
+            return batch.records[key]
+        if self._records is not None:
+            record = self._records.get(key, MISSING)
+            if record is not MISSING:
+                return record
+        async with self.session_factory() as session:
+            q = await session.execute(
+                select(FsmState.state, FsmState.data, FsmState.expires_at).where(FsmState.key == key)
+            )
+            row = q.first()
+        expires_at = row.expires_at if row else None
+        if expires_at is not None and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=UTC)
+        if row is None or expires_at <= datetime.now(UTC):
+            record = (None, {})
+        else:
+            record = (row.state, loads(row.data))
+        if batch is not None:
+            batch.records[key] = record
+        if self._records is not None:
+            self._records.set(key, record)
+        return record
+
+    async def _store(self, key: str, state: Optional[str], data: dict):
+        record = (state, data)
+        self.writes += 1
+        batch = _batch.get()
+        if batch is not None:
+            batch.records[key] = record
+            batch.dirty.add(key)
+        else:
+            await self.flush({key: record})
+        if self._records is not None:
+            self._records.set(key, record)
+
+    async def flush(self, pending: Mapping[str, tuple[Optional[str], dict]]):
+        """Записать изменения одной транзакцией."""
+        if not pending:
+            return
+        now = datetime.now(UTC)
+        expires_at = now + self.ttl
+        upserts = [
+            {"key": key, "state": state, "data": dumps(data), "expires_at": expires_at}
+            for key, (state, data) in pending.items() if state is not None or data
+        ]
+        cleared = [key for key, (state, data) in pending.items() if state is None and not data]
+        try:
+            async with self.session_factory() as session:
+                if cleared:
+                    await session.execute(delete(FsmState).where(FsmState.key.in_(cleared)))
+                if upserts:
+                    stmt = _upsert(session, FsmState).values(upserts)
+                    await session.execute(stmt.on_conflict_do_update(
+                        index_elements=[FsmState.key],
+                        set_={"state": stmt.excluded.state, "data": stmt.excluded.data,
+                              "expires_at": stmt.excluded.expires_at},
+                    ))
+                if time.monotonic() - self._last_purge >= self.purge_interval:
+                    await session.execute(delete(FsmState).where(FsmState.expires_at < now))
+                    self._last_purge = time.monotonic()
+                await session.commit()
+        except Exception:
+            # кэш мог запомнить то, что не записалось, — пусть следующее чтение идёт в БД
+            if self._records is not None:
+                for key in pending:
+                    self._records.invalidate(key)
+            raise
+        self.flushes += 1
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        _, data = await self._load(k)
+        await self._store(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        k = self.key_builder.build(key)
+        state, _ = await self._load(k)
+        await self._store(k, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        logger.info("FSM storage closed: %s writes in %s flushes", self.writes, self.flushes)
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    MemoryStorage для одного процесса, который забывает брошенные сценарии:
+    у каждого ключа скользящий ttl (продлевается при записи), а при превышении
+    max_entries вытесняются давно не использованные (LRU). Очищенное состояние
+    освобождается сразу. Счётчики — см. stats().
+    """
+    def __init__(self, key_builder: Optional[KeyBuilder] = None, ttl: float = 24 * 3600,
+                 max_entries: int = 10000, purge_interval: float = 60.0):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._records = TTLCache("fsm_memory", maxsize=max_entries, ttl=ttl)
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+
+    def _get(self, key: str) -> tuple[Optional[str], dict]:
+        return self._records.get(key, (None, {}))
+
+    def _put(self, key: str, state: Optional[str], data: dict):
+        if state is None and not data:
+            self._records.invalidate(key)
+        else:
+            self._records.set(key, (state, data))
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._records.purge()
+            self._last_purge = time.monotonic()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        _, data = self._get(k)
+        self._put(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._get(self.key_builder.build(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        k = self.key_builder.build(key)
+        state, _ = self._get(k)
+        self._put(k, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._get(self.key_builder.build(key))[1].copy()
+
+    def stats(self) -> dict:
+        self._records.purge()
+        return {"live": len(self._records), "evictions": self._records.evictions, "expired": self._records.expired}
+
+    async def close(self) -> None:
+        logger.info("FSM memory storage closed: %s", self.stats())
@@ -6,20 +6,18 @@ from aiogram.fsm.state import StatesGroup, State
 from datetime import datetime
 
 from dotenv import load_dotenv
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from keyboards import event_actions_kb, events_list_kb, edit_menu_kb, admin_main_menu, back_to_main_menu, \
-    broadcast_mail_menu
-from mailer import Mailer
-from models import AsyncSessionLocal, Event
-from crud import create_event, save_generated_link, get_event, get_registrations_for_event, get_events_by_owner, \
-    delete_event, update_event, get_user_by_tg
-from utils import make_deeplink
-from scheduler import schedule_event_jobs_for_event
+    broadcast_mail_menu, broadcast_control_kb
+from models import User
+from crud import create_event_with_links, get_event, get_events_by_owner, delete_event, update_event
+from outbox import enqueue_event_broadcast, control_broadcast, broadcast_progress, format_progress, display_status
+from scheduler import schedule_event_jobs_for_event, send_broadcast_job
 import os
 import logging
 
-from bot import bot, scheduler
+from bot import scheduler
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -84,9 +82,8 @@ async def cq_admin_create_event(callback: CallbackQuery, state: FSMContext):
 
 # Мои мероприятия
 @router.callback_query(F.data == "admin:my_events")
-async def cq_admin_my_events(callback: CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        events = await get_events_by_owner(session, str(callback.from_user.id))
+async def cq_admin_my_events(callback: CallbackQuery, session: AsyncSession):
+    events = await get_events_by_owner(session, str(callback.from_user.id))
 
     if not events:
         await callback.message.edit_text(
@@ -121,25 +118,40 @@ async def broadcast_get_text(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "broadcast:now")
-async def broadcast_now(callback: CallbackQuery, state: FSMContext):
+async def broadcast_now(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     event_id = data["event_id"]
     text = data["text"]
 
-    async with AsyncSessionLocal() as session:
-        regs = await get_registrations_for_event(session, int(event_id))
-        chat_ids = [r.tg_id for r in regs]
-
-    mailer = Mailer(bot, concurrency=8)
-    await mailer.send_batch(chat_ids, text)
-
-    await callback.message.edit_text(
-        f"✅ Сообщение отправлено ({len(chat_ids)} получателей).",
-        reply_markup=admin_main_menu()
+    # прогресс рассылки воркер будет показывать в этом же сообщении
+    await callback.message.edit_text("📨 Ставлю рассылку в очередь…")
+    bc, _ = await enqueue_event_broadcast(
+        session, int(event_id), text, report_to=(callback.message.chat.id, callback.message.message_id)
     )
+    await show_broadcast_progress(callback.message, session, bc.id)
     await state.clear()
 
 
+async def show_broadcast_progress(message: Message, session: AsyncSession, broadcast_id: int):
+    progress = await broadcast_progress(session, broadcast_id)
+    if progress is None:
+        return
+    bc, counts = progress
+    await message.edit_text(format_progress(bc, counts),
+                            reply_markup=broadcast_control_kb(bc.id, display_status(bc, counts)))
+
+
+@router.callback_query(F.data.startswith("bc:"))
+async def broadcast_control(callback: CallbackQuery, session: AsyncSession):
+    _, action, broadcast_id = callback.data.split(":")
+    status = await control_broadcast(session, int(broadcast_id), action, callback.message.chat.id)
+    if status is None:
+        await callback.answer("Рассылка уже завершена или недоступна.", show_alert=True)
+        return
+    await show_broadcast_progress(callback.message, session, int(broadcast_id))
+    await callback.answer()
+
+
 @router.callback_query(F.data == "broadcast:schedule")
 async def broadcast_schedule(callback: CallbackQuery, state: FSMContext):
     await state.set_state(BroadcastSG.await_schedule_time)
@@ -162,18 +174,13 @@ async def broadcast_get_time(message: Message, state: FSMContext):
         await message.answer("❌ Неверный формат. Укажите так: 18:30 25.12.2025")
         return
 
-    async with AsyncSessionLocal() as session:
-        regs = await get_registrations_for_event(session, int(event_id))
-        chat_ids = [r.tg_id for r in regs]
-
-    mailer = Mailer(bot, concurrency=8)
-
-    # планируем отправку через APScheduler
+    # планируем постановку в outbox через APScheduler
     scheduler.add_job(
-        mailer.send_batch,
+        send_broadcast_job,
         "date",
         run_date=dt,
-        args=[chat_ids, text]
+        args=[int(event_id), text],
+        id=f"broadcast_{event_id}_{dt.timestamp()}"
     )
 
     await message.answer(
@@ -202,18 +209,12 @@ async def broadcast_schedule_time(message: Message, state: FSMContext):
     event_id = data["event_id"]
     text = data["text"]
 
-    async with AsyncSessionLocal() as session:
-        regs = await get_registrations_for_event(session, event_id)
-        chat_ids = [r.tg_id for r in regs]
-
-    mailer = Mailer(bot, concurrency=8)
-
     # планируем задачу
     scheduler.add_job(
-        mailer.send_batch,
+        send_broadcast_job,
         trigger="date",
         run_date=dt,
-        args=[chat_ids, text],
+        args=[int(event_id), text],
         id=f"broadcast_{event_id}_{dt.timestamp()}"
     )
 
@@ -222,15 +223,11 @@ async def broadcast_schedule_time(message: Message, state: FSMContext):
 
 
 @router.message(Command(commands=["create_event"]))
-async def cmd_create_event(message: Message, state: FSMContext):
+async def cmd_create_event(message: Message, state: FSMContext, db_user: User | None):
     # Проверка роли упрощена: предполагаем, что админами являются пользователи с role == 'event_admin' или super_admin
-    tg_id = str(message.from_user.id)
-    async with AsyncSessionLocal() as session:
-        from crud import get_user_by_tg
-        user = await get_user_by_tg(session, tg_id)
-        if not user or user.role not in ("event_admin", "super_admin"):
-            await message.answer("У вас нет прав администратора мероприятия.")
-            return
+    if not db_user or db_user.role not in ("event_admin", "super_admin"):
+        await message.answer("У вас нет прав администратора мероприятия.")
+        return
     await state.set_state(CreateEventSG.await_title)
     await message.answer("Введите заголовок/название мероприятия:")
 
@@ -314,7 +311,7 @@ async def ce_confirm_text(message: Message, state: FSMContext):
 
 
 @router.message(CreateEventSG.await_category)
-async def ce_category(message: Message, state: FSMContext):
+async def ce_category(message: Message, state: FSMContext, session: AsyncSession):
     text = message.text.strip().lower()
     category_id = None
     if text not in ("нет", "no", "-"):
@@ -332,25 +329,22 @@ async def ce_category(message: Message, state: FSMContext):
     confirm_text = data.get("confirm_text")
     owner_tg_id = str(message.from_user.id)
 
-    async with AsyncSessionLocal() as session:
-        ev = await create_event(session, owner_tg_id, title, title, publish_at, reminder_at,
-                                reminder_text, confirm_request_at, confirm_text, category_id)
-        # generate links and store them
-        bot_username = os.getenv("BOT_USERNAME")
-        join = await make_deeplink("join", ev.id, bot_username, session)
-        speaker = await make_deeplink("speaker", ev.id, bot_username, session)
-        await save_generated_link(session, ev.id, "join", join, expires_at=None)
-        await save_generated_link(session, ev.id, "speaker", speaker, expires_at=None)
+    # событие, токены и ссылки — одной транзакцией
+    ev, links = await create_event_with_links(session, owner_tg_id, title, title, publish_at, reminder_at,
+                                              reminder_text, confirm_request_at, confirm_text, category_id,
+                                              bot_username=os.getenv("BOT_USERNAME"))
+    join, speaker = links["join"], links["speaker"]
 
     # schedule jobs
-    await schedule_event_jobs_for_event(ev, bot, scheduler)
+    await schedule_event_jobs_for_event(ev, session)
 
     await message.answer(f"Мероприятие создано. ID={ev.id}\nСсылка для слушателей: {join}\nСсылка для докладчиков: {speaker}")
     await state.clear()
 
 
 @router.message(Command(commands=["message_registrations"]))
-async def cmd_message_registrations(message: Message, state: FSMContext):
+async def cmd_message_registrations(message: Message, state: FSMContext, session: AsyncSession,
+                                    db_user: User | None):
     # Простой flow: /message_registrations <event_id>
     parts = message.text.strip().split()
     if len(parts) != 2:
@@ -363,43 +357,39 @@ async def cmd_message_registrations(message: Message, state: FSMContext):
         return
 
     # проверка прав
-    async with AsyncSessionLocal() as session:
-        ev = await get_event(session, event_id)
-        if not ev:
-            await message.answer("Событие не найдено.")
-            return
-        if ev.owner_tg_id != message.from_user.id and (await get_user_by_tg(session, str(message.from_user.id))) is None:
-            # упрощённая проверка: только владелец или супер-админ (проверку ролей можно улучшить)
-            await message.answer("У вас нет прав на рассылку для этого события.")
-            return
+    ev = await get_event(session, event_id)
+    if not ev:
+        await message.answer("Событие не найдено.")
+        return
+    if ev.owner_tg_id != message.from_user.id and db_user is None:
+        # упрощённая проверка: только владелец или супер-админ (проверку ролей можно улучшить)
+        await message.answer("У вас нет прав на рассылку для этого события.")
+        return
     await state.update_data(target_event_id=event_id)
     await state.set_state(CreateEventSG.confirm)
     await message.answer("Введите текст рассылки (будет отправлен всем зарегистрированным на событие):")
 
 
 @router.message(CreateEventSG.confirm)
-async def do_message_registrations(message: Message, state: FSMContext):
+async def do_message_registrations(message: Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     event_id = data.get("target_event_id")
     text = message.text.strip()
     if not text:
         await message.answer("Текст пустой.")
         return
-    async with AsyncSessionLocal() as session:
-        regs = await get_registrations_for_event(session, event_id)
-        chat_ids = [r.tg_id for r in regs]
-    from mailer import Mailer
-    mailer = Mailer(bot, concurrency=8)
-    await mailer.send_batch(chat_ids, text)
-    await message.answer(f"Рассылка отправлена ({len(chat_ids)} получателей).")
+    status_message = await message.answer("📨 Ставлю рассылку в очередь…")
+    bc, _ = await enqueue_event_broadcast(
+        session, event_id, text, report_to=(status_message.chat.id, status_message.message_id)
+    )
+    await show_broadcast_progress(status_message, session, bc.id)
     await state.clear()
 
 
 @router.message(Command("my_events"))
-async def cmd_my_events(message: Message):
+async def cmd_my_events(message: Message, session: AsyncSession):
     tg_id = str(message.from_user.id)
-    async with AsyncSessionLocal() as session:
-        events = await get_events_by_owner(session, tg_id)
+    events = await get_events_by_owner(session, tg_id)
 
     if not events:
         await message.answer("У вас пока нет мероприятий.")
@@ -412,11 +402,9 @@ async def cmd_my_events(message: Message):
 
 
 @router.callback_query(F.data.startswith("event:"))
-async def cq_event_selected(callback: CallbackQuery):
+async def cq_event_selected(callback: CallbackQuery, session: AsyncSession):
     event_id = int(callback.data.split(":")[1])
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(Event).where(Event.id == event_id))
-        ev = result.scalar_one_or_none()
+    ev = await get_event(session, event_id)
 
     if not ev:
         await callback.answer("Мероприятие не найдено", show_alert=True)
@@ -432,16 +420,15 @@ async def cq_event_selected(callback: CallbackQuery):
 
 # --- Callback для кнопки "Редактировать" ---
 @router.callback_query(F.data.startswith("edit:"))
-async def cq_edit_event(callback: CallbackQuery, state: FSMContext):
+async def cq_edit_event(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     # data вида: "edit:<event_id>"
     event_id = int(callback.data.split(":")[1])
 
     # получаем данные события
-    async with AsyncSessionLocal() as session:
-        event = await get_event(session, event_id)
-        if not event:
-            await callback.answer("Мероприятие не найдено", show_alert=True)
-            return
+    event = await get_event(session, event_id)
+    if not event:
+        await callback.answer("Мероприятие не найдено", show_alert=True)
+        return
 
     # сохраняем event_id в state
     await state.update_data(edit_event_id=event_id)
@@ -454,7 +441,7 @@ async def cq_edit_event(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith(("edit_field:", "event:")))
-async def cq_edit(callback: CallbackQuery, state: FSMContext):
+async def cq_edit(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     data = callback.data
 
     if data.startswith("edit_field:"):
@@ -471,14 +458,13 @@ async def cq_edit(callback: CallbackQuery, state: FSMContext):
         event_id = int(data.split(":")[1])
         # здесь нужно достать событие и показать его текст + кнопки редактирования
         # например:
-        async with AsyncSessionLocal() as session:
-            event = await get_event(session, event_id)
-            await callback.message.edit_text(f"Событие: {event.title}", reply_markup=edit_menu_kb(event_id))
-            await callback.answer("Возврат к событию")
+        event = await get_event(session, event_id)
+        await callback.message.edit_text(f"Событие: {event.title}", reply_markup=edit_menu_kb(event_id))
+        await callback.answer("Возврат к событию")
 
 
 @router.message(EditEventSG.await_new_value)
-async def save_new_value(message: Message, state: FSMContext):
+async def save_new_value(message: Message, state: FSMContext, session: AsyncSession):
     data = await state.get_data()
     event_id = data.get("edit_event_id")
     field = data.get("edit_field")
@@ -489,8 +475,16 @@ async def save_new_value(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    async with AsyncSessionLocal() as session:
-        await update_event(session, event_id, **{field: new_value})
+    if field.endswith("_at"):
+        new_value = parse_dt(new_value)
+        if not new_value:
+            await message.answer("Неправильный формат даты. Попробуйте снова в формате ЧЧ:ММ ДД.ММ.ГГГГ.")
+            return
+
+    ev = await update_event(session, event_id, **{field: new_value})
+    if ev and field.endswith("_at"):
+        # перепланируем задачи события под новые даты
+        await schedule_event_jobs_for_event(ev, session)
 
     await message.answer(f"Поле {field} успешно обновлено.")
     await state.clear()
@@ -498,12 +492,11 @@ async def save_new_value(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("delete:"))
-async def cq_event_delete(callback: CallbackQuery):
+async def cq_event_delete(callback: CallbackQuery, session: AsyncSession):
     event_id = int(callback.data.split(":")[1])
     tg_id = str(callback.from_user.id)
 
-    async with AsyncSessionLocal() as session:
-        ok = await delete_event(session, event_id, tg_id)
+    ok = await delete_event(session, event_id, tg_id)
 
     if ok:
         await callback.message.edit_text("✅ Мероприятие удалено")
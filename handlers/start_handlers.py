@@ -4,11 +4,12 @@ from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from keyboards import admin_reply_menu
 from utils import verify_payload
-from crud import add_registration, mark_confirmed, create_user_if_not_exists, get_user_role, get_user_by_tg
-from models import AsyncSessionLocal
+from crud import register_user_for_event, mark_confirmed, unsuppress_recipient
+from models import User
 import logging
 
 load_dotenv()
@@ -34,26 +35,29 @@ class RegSpeakerSG(StatesGroup):
 
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, command: CommandObject, state: FSMContext):
-    async with AsyncSessionLocal() as session:
-        if db_user := await get_user_by_tg(session, str(message.from_user.id)):
-            if db_user.role in ["event_admin", "super_admin"]:
-                await message.answer(
-                    "Добро пожаловать, админ! 📋 Кнопка меню всегда доступна снизу.",
-                    reply_markup=admin_reply_menu()
-                )
-        else:
-            await message.answer("Привет! Это бот для мероприятий 👋")
+async def cmd_start(message: Message, command: CommandObject, state: FSMContext,
+                    session: AsyncSession, db_user: User | None):
+    # раз пишет боту — снова доступен для рассылок
+    await unsuppress_recipient(session, str(message.from_user.id))
+
+    if db_user:
+        if db_user.role in ["event_admin", "super_admin"]:
+            await message.answer(
+                "Добро пожаловать, админ! 📋 Кнопка меню всегда доступна снизу.",
+                reply_markup=admin_reply_menu()
+            )
+    else:
+        await message.answer("Привет! Это бот для мероприятий 👋")
 
     token = command.args
     if not token:
         await message.answer("Привет! Чтобы зарегистрироваться на мероприятие, используйте ссылку регистрации.")
         return
 
-    async with AsyncSessionLocal() as session:
-        payload = await verify_payload(token, session)
+    payload = await verify_payload(token, session)
 
-    if not payload:
+    # персональная подписанная ссылка работает только у своего получателя
+    if not payload or payload.get("recipient_id", message.from_user.id) != message.from_user.id:
         await message.answer("Неправильная или просроченная ссылка.")
         return
 
@@ -70,12 +74,11 @@ async def cmd_start(message: Message, command: CommandObject, state: FSMContext)
         await message.answer("Регистрация докладчика.\nВведите ваше имя:")
     elif kind == "confirm":
         tg_id = str(message.from_user.id)
-        async with AsyncSessionLocal() as session:
-            ok = await mark_confirmed(session, event_id, tg_id)
-            if ok:
-                await message.answer("Спасибо! Вы подтвердили участие.")
-            else:
-                await message.answer("Не удалось найти вашу регистрацию для подтверждения.")
+        ok = await mark_confirmed(session, event_id, tg_id)
+        if ok:
+            await message.answer("Спасибо! Вы подтвердили участие.")
+        else:
+            await message.answer("Не удалось найти вашу регистрацию для подтверждения.")
     else:
         await message.answer("Неизвестный тип ссылки.")
 
@@ -121,7 +124,7 @@ async def listener_specialty(message: Message, state: FSMContext):
 
 
 @router.message(RegListenerSG.await_company)
-async def listener_company(message: Message, state: FSMContext):
+async def listener_company(message: Message, state: FSMContext, session: AsyncSession):
     text = message.text.strip()
     company = None if text.lower() in ("пропустить", "skip", "-") else text
     data = await state.get_data()
@@ -132,10 +135,9 @@ async def listener_company(message: Message, state: FSMContext):
     tg_id = str(message.from_user.id)
     tg_username = message.from_user.username
 
-    async with AsyncSessionLocal() as session:
-        # ensure user exists
-        await create_user_if_not_exists(session, tg_id, tg_username)
-        await add_registration(session, event_id, tg_id, "listener", name, age, specialty, company, None)
+    # пользователь и регистрация — два upsert'а в одной транзакции
+    await register_user_for_event(session, tg_id, tg_username, event_id, "listener",
+                                  name, age, specialty, company, None)
     await message.answer("Спасибо — вы зарегистрированы как слушатель. До встречи!")
     await state.clear()
 
@@ -190,7 +192,7 @@ async def speaker_company(message: Message, state: FSMContext):
 
 
 @router.message(RegSpeakerSG.await_topic)
-async def speaker_topic(message: Message, state: FSMContext):
+async def speaker_topic(message: Message, state: FSMContext, session: AsyncSession):
     topic = message.text.strip()
     if not topic:
         await message.answer("Тема не может быть пустой. Введите снова:")
@@ -204,8 +206,7 @@ async def speaker_topic(message: Message, state: FSMContext):
     tg_id = str(message.from_user.id)
     tg_username = message.from_user.username
 
-    async with AsyncSessionLocal() as session:
-        await create_user_if_not_exists(session, tg_id, tg_username)
-        await add_registration(session, event_id, tg_id, "speaker", name, age, specialty, company, topic)
+    await register_user_for_event(session, tg_id, tg_username, event_id, "speaker",
+                                  name, age, specialty, company, topic)
     await message.answer("Спасибо — вы зарегистрированы как докладчик. Мы свяжемся при необходимости.")
     await state.clear()
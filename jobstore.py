@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import pickle
+import time
+from datetime import datetime
+
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.util import datetime_to_utc_timestamp
+from sqlalchemy import select, delete, insert
+
+from models import AsyncSessionLocal, SchedulerJob, SchedulerMeta
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentJobStore(MemoryJobStore):
+    """
+    MemoryJobStore, изменения которого дублируются в таблицу scheduler_jobs.
+    APScheduler вызывает методы jobstore синхронно из event loop, а драйвер у нас async,
+    поэтому запись идёт фоновой задачей (write-behind) через общий движок,
+    а задачи поднимаются из БД вызовом load()/reload().
+    С несколькими репликами задачи исполняет только лидер: он периодически вызывает load(),
+    чтобы подхватить задачи, добавленные другими репликами.
+    """
+    def __init__(self, pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.pickle_protocol = pickle_protocol
+        self._ops: asyncio.Queue = asyncio.Queue()
+        self._writer: asyncio.Task | None = None
+        # удалённые здесь задачи: id -> время, когда удаление дошло до БД (None — ещё в очереди);
+        # load() не должен воскресить задачу, которую мы уже исполнили, по устаревшей строке
+        self._removed: dict[str, float | None] = {}
+
+    async def load(self, scheduler, alias: str = "default") -> int:
+        """Поднять в память сохранённые задачи, которых там ещё нет (без повторной записи в БД)."""
+        self._scheduler = scheduler
+        self._alias = alias
+        started = time.monotonic()
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(select(SchedulerJob.id, SchedulerJob.job_state))
+            rows = q.all()
+        loaded = 0
+        for job_id, job_state in rows:
+            if job_id in self._removed:
+                continue
+            try:
+                job = self._reconstitute_job(job_state)
+            except Exception:
+                logger.exception("Unable to restore job %s, dropping it", job_id)
+                self._ops.put_nowait(("delete", job_id))
+                continue
+            if job.id not in self._jobs_index:
+                MemoryJobStore.add_job(self, job)
+                loaded += 1
+        # удаления, записанные до начала выборки, она уже учла
+        for job_id, flushed in list(self._removed.items()):
+            if flushed is not None and flushed < started:
+                del self._removed[job_id]
+        if loaded:
+            logger.info("Restored %s scheduler jobs", loaded)
+        return loaded
+
+    async def reload(self, scheduler, alias: str = "default") -> int:
+        """Заменить задачи в памяти состоянием БД (после записи своих изменений)."""
+        if self._writer is not None and not self._writer.done():
+            await self._ops.join()
+        MemoryJobStore.remove_all_jobs(self)
+        self._removed.clear()
+        return await self.load(scheduler, alias)
+
+    def _reconstitute_job(self, job_state: bytes) -> Job:
+        state = pickle.loads(job_state)
+        state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _save(self, job: Job):
+        state = pickle.dumps(job.__getstate__(), self.pickle_protocol)
+        self._ops.put_nowait(("save", job.id, datetime_to_utc_timestamp(job.next_run_time), state))
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_loop())
+
+    def add_job(self, job: Job):
+        super().add_job(job)
+        self._removed.pop(job.id, None)
+        self._save(job)
+
+    def update_job(self, job: Job):
+        super().update_job(job)
+        self._save(job)
+
+    def remove_job(self, job_id):
+        super().remove_job(job_id)
+        self._removed[job_id] = None
+        self._ops.put_nowait(("delete", job_id))
+
+    def remove_all_jobs(self):
+        super().remove_all_jobs()
+        self._ops.put_nowait(("clear",))
+
+    def shutdown(self):
+        # MemoryJobStore.shutdown() чистит задачи через remove_all_jobs — в БД они должны остаться
+        MemoryJobStore.remove_all_jobs(self)
+
+    async def _write_loop(self):
+        while True:
+            ops = [await self._ops.get()]
+            while not self._ops.empty() and len(ops) < 100:
+                ops.append(self._ops.get_nowait())
+            try:
+                async with AsyncSessionLocal() as session:
+                    for op in ops:
+                        if op[0] == "clear":
+                            await session.execute(delete(SchedulerJob))
+                            continue
+                        await session.execute(delete(SchedulerJob).where(SchedulerJob.id == op[1]))
+                        if op[0] == "save":
+                            await session.execute(insert(SchedulerJob).values(
+                                id=op[1], next_run_time=op[2], job_state=op[3]
+                            ))
+                    await session.commit()
+                flushed = time.monotonic()
+                for op in ops:
+                    if op[0] == "delete" and op[1] in self._removed:
+                        self._removed[op[1]] = flushed
+            except Exception:
+                logger.exception("Failed to persist %s scheduler job changes", len(ops))
+            finally:
+                for _ in ops:
+                    self._ops.task_done()
+
+    async def close(self):
+        """Дописать накопленные изменения и остановить фоновую запись."""
+        if self._writer is None:
+            return
+        await self._ops.join()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._writer = None
+
+
+async def get_marker(key: str) -> datetime | None:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(SchedulerMeta.value).where(SchedulerMeta.key == key))
+
+
+async def set_marker(key: str, value: datetime):
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(SchedulerMeta).where(SchedulerMeta.key == key))
+        session.add(SchedulerMeta(key=key, value=value))
+        await session.commit()
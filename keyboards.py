@@ -64,3 +64,19 @@ def back_to_main_menu():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅️ Вернуться в главное меню", callback_data="admin:menu")]
     ])
+
+
+def broadcast_control_kb(broadcast_id: int, status: str):
+    """
+    Кнопки управления идущей рассылкой; у завершённой или отменённой вместо них
+    главное меню админа, как после отправки.
+    """
+    if status == "pending":
+        toggle = InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bc:pause:{broadcast_id}")
+    elif status == "paused":
+        toggle = InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bc:resume:{broadcast_id}")
+    else:
+        return admin_main_menu()
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [toggle, InlineKeyboardButton(text="✖️ Отменить", callback_data=f"bc:cancel:{broadcast_id}")]
+    ])
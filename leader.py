@@ -0,0 +1,166 @@
+import asyncio
+import fcntl
+import logging
+import os
+import tempfile
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from models import engine
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# общий ключ advisory lock'а для всех реплик бота
+LEADER_LOCK_KEY = int(os.getenv("LEADER_LOCK_KEY", "724270185"))
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "meetuper-leader.lock"))
+
+
+class AdvisoryLock:
+    """
+    Session-level pg_try_advisory_lock на отдельном соединении. Лок живёт, пока живо
+    соединение: упавшая реплика освобождает его сразу, как Postgres закроет её сессию.
+    """
+    def __init__(self, engine: AsyncEngine, key: int = LEADER_LOCK_KEY):
+        self.engine = engine
+        self.key = key
+        self._conn: AsyncConnection | None = None
+
+    async def acquire(self) -> bool:
+        conn = await self.engine.connect()
+        try:
+            acquired = await conn.scalar(select(func.pg_try_advisory_lock(self.key)))
+            # соединение держим без открытой транзакции, чтобы не мешать vacuum
+            await conn.commit()
+        except Exception:
+            await conn.close()
+            raise
+        if not acquired:
+            await conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    async def check(self) -> bool:
+        if self._conn is None:
+            return False
+        try:
+            await self._conn.scalar(select(1))
+            await self._conn.commit()
+            return True
+        except Exception:
+            logger.exception("Leader lock connection lost")
+            await self.release()
+            return False
+
+    async def release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            await conn.scalar(select(func.pg_advisory_unlock(self.key)))
+            await conn.commit()
+        except Exception:
+            # сломанное соединение (а с ним и лок) не возвращаем в пул
+            await conn.invalidate()
+        finally:
+            await conn.close()
+
+
+class FileLock:
+    """Замена advisory lock'а для SQLite и локальных прогонов: flock на файле, реплики на одной машине."""
+    def __init__(self, path: str = LEADER_LOCK_FILE):
+        self.path = path
+        self._fd: int | None = None
+
+    async def acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    async def check(self) -> bool:
+        return self._fd is not None
+
+    async def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def make_leader_lock():
+    """Advisory lock на Postgres, файловый лок на остальных базах."""
+    if engine.dialect.name == "postgresql":
+        return AdvisoryLock(engine)
+    return FileLock()
+
+
+class LeaderElection:
+    """
+    Выбор лидера среди реплик: каждые interval секунд не-лидер пытается взять лок,
+    лидер проверяет, что лок ещё за ним. on_elected/on_demoted запускают и
+    останавливают то, что должно работать в единственном экземпляре.
+    """
+    def __init__(self, lock, on_elected: Callable[[], Awaitable], on_demoted: Callable[[], Awaitable],
+                 interval: float = 2.0):
+        self.lock = lock
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.interval = interval
+        self.is_leader = False
+        self._task: asyncio.Task | None = None
+
+    async def _elect(self):
+        self.is_leader = True
+        logger.info("This replica is now the leader")
+        try:
+            await self.on_elected()
+        except Exception:
+            logger.exception("Leader startup failed, stepping down")
+            await self._demote()
+
+    async def _demote(self):
+        self.is_leader = False
+        logger.warning("This replica is no longer the leader")
+        try:
+            await self.on_demoted()
+        finally:
+            await self.lock.release()
+
+    async def run(self):
+        while True:
+            try:
+                if not self.is_leader:
+                    if await self.lock.acquire():
+                        await self._elect()
+                elif not await self.lock.check():
+                    await self._demote()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Leader election iteration failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self._demote()
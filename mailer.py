@@ -1,57 +1,200 @@
 import asyncio
 import random
 import logging
-from typing import List
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, AsyncIterable, Iterable
 from aiogram import Bot
-from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError, TelegramServerError,
+)
+
+from metrics import MAILER_SEND_SECONDS, MAILER_EVENTS
+from ratelimiter import AIMDWindow, TelegramRateLimiter, limiter as default_limiter, rate_limited
 
 logger = logging.getLogger(__name__)
 
+
+@dataclass
+class SendStats:
+    """Агрегированные счётчики рассылки (вместо списка Message на каждого получателя)."""
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retried: int = 0
+
+    def merge(self, other: "SendStats"):
+        self.sent += other.sent
+        self.failed += other.failed
+        self.blocked += other.blocked
+        self.retried += other.retried
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+async def _aiter(items: AsyncIterable | Iterable):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
 class Mailer:
     """
-    Mailer с простым rate limit (concurrency semaphore) и retry.
+    Mailer с rate limit и retry.
     concurrency: одновременно отправлять не более N сообщений.
+    adaptive: окно одновременных отправок подстраивается само (AIMDWindow): concurrency —
+        стартовый размер, max_concurrency — потолок. Текущий размер — window_size (в /metrics его отдаёт OutboxWorker).
+    priority: класс в общем лимитере (urgent — напоминания/подтверждения, bulk — массовые рассылки).
+    limiter: общий на процесс TelegramRateLimiter — все Mailer'ы делят один бюджет Telegram.
     retry: при ошибках  retry с экспоненциальным бэкофом.
+    Недоступные личные чаты (бот заблокирован, чат не найден) копятся до pop_blocked() —
+    вызывающий сохраняет их в blocked_recipients, и дальше они не попадают в рассылки.
     """
-    def __init__(self, bot: Bot, concurrency: int = 10, base_delay: float = 1.0, max_attempts: int = 5):
+    def __init__(self, bot: Bot, concurrency: int = 10, base_delay: float = 1.0, max_attempts: int = 5,
+                 limiter: TelegramRateLimiter | None = None, adaptive: bool = False, max_concurrency: int = 100,
+                 priority: str = "bulk"):
         self.bot = bot
-        self.semaphore = asyncio.Semaphore(concurrency)
+        self.priority = priority
+        self.concurrency = concurrency
+        self.window = AIMDWindow(initial=concurrency, max_limit=max_concurrency) if adaptive else None
+        self.semaphore = self.window or asyncio.Semaphore(concurrency)
+        self.limiter = limiter or default_limiter
         self.base_delay = base_delay
         self.max_attempts = max_attempts
+        self._blocked: Dict[str, str] = {}
+
+    def _mark_blocked(self, chat_id, reason: str):
+        # только личные чаты: группу/канал из BROADCAST_CHAT_ID молча глушить нельзя
+        if not str(chat_id).startswith(("-", "@")):
+            self._blocked[str(chat_id)] = reason
+
+    def pop_blocked(self) -> Dict[str, str]:
+        """Забрать накопленные недоступные чаты: chat_id -> reason."""
+        blocked, self._blocked = self._blocked, {}
+        return blocked
 
-    async def _send_with_retry(self, chat_id: int, text: str, **kwargs):
+    @property
+    def window_size(self) -> int:
+        """Сколько отправок сейчас разрешено одновременно."""
+        return self.window.size if self.window else self.concurrency
+
+    async def _send_with_retry(self, chat_id: int, text: str, stats: SendStats | None = None, **kwargs):
+        stats = stats or SendStats()
         attempt = 0
         while True:
             try:
+                # сначала токен лимитера, потом слот окна: ожидание лимита не считается
+                # отправкой «в полёте», иначе окно всегда выбрано и AIMD растит его до потолка
+                await self.limiter.acquire(chat_id, self.priority)
                 async with self.semaphore:
-                    return await self.bot.send_message(chat_id, text, **kwargs)
+                    started = time.monotonic()
+                    token = rate_limited.set(True)
+                    try:
+                        result = await self.bot.send_message(chat_id, text, **kwargs)
+                    finally:
+                        rate_limited.reset(token)
+                        latency = time.monotonic() - started
+                        MAILER_SEND_SECONDS.observe(latency, self.priority)
+                    if self.window:
+                        self.window.on_success(latency)
+                stats.sent += 1
+                MAILER_EVENTS.inc(self.priority, "sent")
+                return result
             except TelegramRetryAfter as e:
-                # Bot is rate-limited by Telegram, wait as told
+                MAILER_EVENTS.inc(self.priority, "rate_limited")
+                # Bot is rate-limited by Telegram: pause the shared bucket, acquire() will wait
                 wait = e.retry_after + 0.5
-                logger.warning("Rate limited, sleeping %s seconds (TelegramRetryAfter)", wait)
-                await asyncio.sleep(wait)
+                logger.warning("Rate limited on %s, pausing for %s seconds (TelegramRetryAfter)", chat_id, wait)
+                self.limiter.retry_after(chat_id, wait)
+                self._congestion()
+                stats.retried += 1
             except TelegramForbiddenError:
                 # user blocked the bot or chat not accessible -> stop retrying
                 logger.warning("Can't send message to %s: forbidden", chat_id)
+                MAILER_EVENTS.inc(self.priority, "forbidden")
+                stats.blocked += 1
+                self._mark_blocked(chat_id, "blocked")
                 return None
             except TelegramBadRequest as e:
-                # Bad request (maybe text too long, or chat not found)
+                if "chat not found" in e.message.lower():
+                    logger.warning("Can't send message to %s: chat not found", chat_id)
+                    MAILER_EVENTS.inc(self.priority, "chat_not_found")
+                    stats.blocked += 1
+                    self._mark_blocked(chat_id, "chat_not_found")
+                    return None
+                # Bad request (maybe text too long)
                 logger.warning("Bad request sending to %s: %s", chat_id, e)
+                MAILER_EVENTS.inc(self.priority, "bad_request")
+                stats.failed += 1
                 return None
             except Exception as e:
+                if isinstance(e, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)):
+                    self._congestion()
                 attempt += 1
                 if attempt >= self.max_attempts:
                     logger.exception("Failed to send message to %s after %s attempts", chat_id, attempt)
+                    MAILER_EVENTS.inc(self.priority, "failed")
+                    stats.failed += 1
                     return None
                 delay = self.base_delay * (2 ** (attempt - 1)) + random.uniform(0, 0.5)
                 logger.warning("Error send to %s: %s — retry %s after %.1fs", chat_id, e, attempt, delay)
+                MAILER_EVENTS.inc(self.priority, "retry")
+                stats.retried += 1
                 await asyncio.sleep(delay)
 
+    def _congestion(self):
+        if self.window:
+            self.window.on_congestion()
+            logger.info("Send window reduced to %s", self.window.size)
+
+    async def deliver(self, chat_id, text: str, stats: SendStats | None = None, **kwargs) -> str:
+        """Отправить одно сообщение и вернуть исход: sent | blocked | failed."""
+        one = SendStats()
+        await self._send_with_retry(chat_id, text, stats=one, **kwargs)
+        if stats is not None:
+            stats.merge(one)
+        if one.sent:
+            return "sent"
+        return "blocked" if one.blocked else "failed"
+
     async def send_batch(self, chat_ids: List[int], text: str, **kwargs):
         """
         Отправляет текст списку chat_ids параллельно с concurrency limit.
         Возвращает список ответов (None для неуспешных).
+        Для больших аудиторий используйте send_stream.
         """
         tasks = [asyncio.create_task(self._send_with_retry(cid, text, **kwargs)) for cid in chat_ids]
         results = await asyncio.gather(*tasks)
         return results
+
+    async def send_stream(self, chat_ids: AsyncIterable | Iterable, text: str,
+                          workers: int | None = None, **kwargs) -> SendStats:
+        """
+        Потоковая рассылка: chat_ids читаются из (асинхронного) итератора
+        и раздаются фиксированному пулу из workers воркеров через ограниченную очередь.
+        Память не зависит от размера аудитории. Возвращает SendStats.
+        """
+        workers = workers or self.concurrency
+        stats = SendStats()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+
+        async def worker():
+            while (chat_id := await queue.get()) is not None:
+                await self._send_with_retry(chat_id, text, stats=stats, **kwargs)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            async for chat_id in _aiter(chat_ids):
+                await queue.put(chat_id)
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        logger.info("Stream send finished: %s (window %s)", stats, self.window_size)
+        return stats
@@ -1,46 +1,139 @@
+import argparse
 import logging
 import asyncio
+import os
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from bot import bot, scheduler
+import cache
+from bot import bot, scheduler, jobstore
+from fsm_storage import SQLAlchemyStorage, BoundedMemoryStorage
+from leader import LeaderElection, make_leader_lock
 from handlers.start_handlers import router as start_router
 from handlers.admin_handlers import router as admin_router
-from models import init_db, AsyncSessionLocal
-from scheduler import init_scheduler
+from metrics import instrument_caches, instrument_engine, instrument_fsm_storage, instrument_scheduler, start_metrics_server
+from middlewares import DbSessionMiddleware, FsmBatchMiddleware, RateLimitRequestMiddleware, HandlerTimingMiddleware
+from models import init_db, AsyncSessionLocal, engine
+from outbox import OutboxWorker
+from ratelimiter import limiter
+from due_dispatcher import DueDispatcher
+from scheduler import init_scheduler, EVENT_JOBS
+from webhook import run_webhook
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# FSM_STORAGE=memory — состояние только в памяти процесса (одна реплика), с TTL и лимитом записей
+if os.getenv("FSM_STORAGE", "db") == "memory":
+    storage = BoundedMemoryStorage(ttl=float(os.getenv("FSM_TTL", "86400")),
+                                   max_entries=int(os.getenv("FSM_MAX_ENTRIES", "10000")))
+    instrument_fsm_storage(storage)
+else:
+    # FSM_READ_TTL > 0 — кэш чтений FSM между апдейтами, только если реплика одна
+    storage = SQLAlchemyStorage(read_ttl=float(os.getenv("FSM_READ_TTL", "0")))
+batch_fsm = isinstance(storage, SQLAlchemyStorage)
+dp = Dispatcher(storage=storage, disable_fsm=batch_fsm)
+if batch_fsm:
+    # записи FSM за апдейт — одной транзакцией в конце апдейта. Батч оборачивает и чтение
+    # состояния FSM-middleware, и сессию апдейта: сброс идёт, когда её соединение уже вернулось в пул
+    dp.update.outer_middleware(FsmBatchMiddleware(storage))
+    dp.update.outer_middleware(dp.fsm)
+
+# одна сессия БД и пользователь на каждый апдейт
+dp.update.outer_middleware(DbSessionMiddleware())
+# время хендлеров для /metrics
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+# ответы хендлеров делят бюджет Telegram с рассылками, но с наивысшим приоритетом
+bot.session.middleware(RateLimitRequestMiddleware(limiter))
 
 # регистрируем роутеры
 dp.include_router(start_router)
 dp.include_router(admin_router)
 
+# MAILER_ADAPTIVE=0 — фиксированные 10 одновременных отправок вместо AIMD-окна
+outbox_worker = OutboxWorker(bot, adaptive=os.getenv("MAILER_ADAPTIVE", "1") == "1")
+due_dispatcher = DueDispatcher(EVENT_JOBS)
+instrument_engine(engine)
+instrument_scheduler(scheduler)
+instrument_caches(cache.CACHES)
+_metrics_server = None
+
+_jobstore_sync: asyncio.Task | None = None
+
+
+async def sync_jobstore(interval: float = 5.0):
+    """Лидер подхватывает задачи, запланированные админами через другие реплики."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await jobstore.load(scheduler):
+                scheduler.wakeup()
+        except Exception:
+            logger.exception("Jobstore sync failed")
+
+
+async def on_elected():
+    global _jobstore_sync
+    await init_scheduler(scheduler, jobstore)
+    scheduler.resume()
+    due_dispatcher.start()
+    _jobstore_sync = asyncio.create_task(sync_jobstore())
+    logger.info("✅ Планировщик запущен")
+
+
+async def on_demoted():
+    global _jobstore_sync
+    scheduler.pause()
+    if _jobstore_sync:
+        _jobstore_sync.cancel()
+        _jobstore_sync = None
+    await due_dispatcher.stop()
+
+
+# запланированные действия исполняет одна реплика; апдейты обрабатывают все
+leader = LeaderElection(make_leader_lock(), on_elected, on_demoted)
+
+
 async def on_startup():
+    global _metrics_server
     logger.info("🚀 Запуск бота...")
     await init_db()
-    await init_scheduler(bot, scheduler)
-    scheduler.start()
-    logger.info("✅ Планировщик запущен")
+    # METRICS_PORT — отдавать /metrics в формате Prometheus на отдельном порту
+    _metrics_server = await start_metrics_server()
+    # до выборов планировщик стоит на паузе, но уже сохраняет задачи, добавленные админами
+    scheduler.start(paused=True)
+    outbox_worker.start()
+    leader.start()
 
 
 async def on_shutdown():
     logger.info("🛑 Остановка бота...")
+    await leader.stop()
     scheduler.shutdown()
+    await jobstore.close()
+    await outbox_worker.stop()
+    if _metrics_server:
+        await _metrics_server.cleanup()
+    logger.info("Cache stats: %s", cache.stats())
     await bot.session.close()
     await AsyncSessionLocal().close()
 
 
-async def main():
+async def main(mode: str = "polling"):
     await on_startup()
     try:
-        await dp.start_polling(bot, skip_updates=True)
+        if mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # вебхук, оставшийся от webhook-режима, не даст getUpdates работать
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, skip_updates=True)
     finally:
         await on_shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=os.getenv("BOT_MODE", "polling"),
+                        help="способ получения апдейтов (по умолчанию BOT_MODE или polling)")
+    asyncio.run(main(parser.parse_args().mode))
@@ -0,0 +1,285 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from datetime import datetime, UTC
+from typing import Callable, Iterable
+
+from aiohttp import web
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# отдельный порт для /metrics (не публичный порт вебхука); без него сервер метрик не поднимается
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонный счётчик; значения меток передаются позиционно: inc("bulk", "sent")."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}"
+
+
+class Gauge(_Metric):
+    """Текущее значение: задаётся set() или вычисляется функцией при каждом сборе."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float | Callable[[], float]] = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def set_function(self, fn: Callable[[], float], *labels):
+        self._values[labels] = fn
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    logger.exception("Gauge %s callback failed", self.name)
+                    continue
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}"
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма с фиксированными корзинами. observe() — поиск корзины и два сложения,
+    накопительные суммы считаются только при отдаче /metrics.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # по меткам: [счётчики по корзинам (+Inf последней), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def count(self, *labels) -> int:
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        for labels, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _num(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_num(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# отправка сообщений (Mailer)
+MAILER_SEND_SECONDS = Histogram(
+    "mailer_send_seconds", "Длительность запроса sendMessage", ("priority",))
+MAILER_EVENTS = Counter(
+    "mailer_events_total",
+    "Исходы попыток отправки: sent, retry, rate_limited (429), forbidden, chat_not_found, bad_request, failed",
+    ("priority", "outcome"))
+MAILER_WINDOW = Gauge("mailer_window_size", "Разрешено одновременных отправок", ("priority",))
+
+# запланированные действия: фактический старт минус запланированное время
+SCHEDULER_LAG_SECONDS = Histogram(
+    "scheduler_job_lag_seconds", "Опоздание запуска запланированной задачи", ("job",), buckets=LAG_BUCKETS)
+
+# обработка апдейтов
+HANDLER_SECONDS = Histogram("handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_ERRORS = Counter("handler_errors_total", "Исключения в хендлерах", ("handler",))
+
+# база данных
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время выполнения SQL-запроса", ("statement",))
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_checkout_seconds", "Ожидание соединения из пула")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Соединений выдано из пула")
+
+# внутрипроцессные кэши (cache.TTLCache), метка — имя кэша
+CACHE_SIZE = Gauge("cache_entries", "Записей в кэше", ("cache",))
+CACHE_HITS = Gauge("cache_hits_total", "Попаданий в кэш", ("cache",))
+CACHE_MISSES = Gauge("cache_misses_total", "Промахов кэша (включая истёкшие записи)", ("cache",))
+CACHE_EVICTIONS = Gauge("cache_evictions_total", "Записей, вытесненных по maxsize (LRU)", ("cache",))
+CACHE_EXPIRED = Gauge("cache_expired_total", "Записей, удалённых по TTL", ("cache",))
+
+# FSM в памяти процесса (FSM_STORAGE=memory)
+FSM_ENTRIES = Gauge("fsm_entries", "Живых записей FSM в памяти")
+FSM_EVICTIONS = Gauge("fsm_evictions_total", "Записей FSM, вытесненных по лимиту (LRU)")
+FSM_EXPIRED = Gauge("fsm_expired_total", "Записей FSM, удалённых по TTL")
+
+
+def _statement_kind(statement: str) -> str:
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return verb if verb in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+def _instrument_pool(pool):
+    # у SQLAlchemy нет события "до выдачи соединения" — оборачиваем Pool.connect
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.set_function(pool.checkedout)
+
+
+def instrument_caches(caches: Iterable):
+    """Счётчики TTLCache читаются при каждом сборе — hit rate и давление вытеснения видны на живом боте."""
+    for c in caches:
+        CACHE_SIZE.set_function(c.__len__, c.name)
+        CACHE_HITS.set_function(lambda c=c: c.hits, c.name)
+        CACHE_MISSES.set_function(lambda c=c: c.misses, c.name)
+        CACHE_EVICTIONS.set_function(lambda c=c: c.evictions, c.name)
+        CACHE_EXPIRED.set_function(lambda c=c: c.expired, c.name)
+
+
+def instrument_fsm_storage(storage):
+    """Счётчики BoundedMemoryStorage: stats() при каждом сборе (он же чистит истёкшие записи)."""
+    FSM_ENTRIES.set_function(lambda: storage.stats()["live"])
+    FSM_EVICTIONS.set_function(lambda: storage.stats()["evictions"])
+    FSM_EXPIRED.set_function(lambda: storage.stats()["expired"])
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Время запросов через события курсора и ожидание соединения из пула."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, _statement_kind(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(ctx):
+        if ctx.connection is not None and ctx.connection.info.get("query_started"):
+            ctx.connection.info["query_started"].pop()
+
+    @event.listens_for(sync_engine, "engine_disposed")
+    def _disposed(engine):
+        # dispose() создаёт новый пул — инструментируем и его
+        _instrument_pool(engine.pool)
+
+    _instrument_pool(sync_engine.pool)
+
+
+class _LagExecutor(AsyncIOExecutor):
+    """
+    Исполнитель APScheduler, который пишет опоздание задачи в момент передачи на исполнение.
+    Здесь, в отличие от EVENT_JOB_SUBMITTED, задача ещё доступна (разовую планировщик к событию
+    уже удаляет), и метка — имя функции, как у DueDispatcher, а не id задачи.
+    """
+    def submit_job(self, job, run_times):
+        super().submit_job(job, run_times)
+        lag = (datetime.now(UTC) - max(run_times)).total_seconds()
+        SCHEDULER_LAG_SECONDS.observe(max(lag, 0.0), job.func.__name__)
+
+
+def instrument_scheduler(scheduler):
+    """Опоздание задач APScheduler: момент передачи исполнителю минус run_date. Вызывать до start()."""
+    scheduler.add_executor(_LagExecutor(), "default")
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Поднять /metrics на отдельном порту; без METRICS_PORT ничего не делает."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics served on %s:%s/metrics", host, port)
+    return runner
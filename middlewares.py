@@ -0,0 +1,100 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from crud import get_user_cached
+from fsm_storage import SQLAlchemyStorage
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS
+from models import AsyncSessionLocal
+from ratelimiter import TelegramRateLimiter, rate_limited
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: одна AsyncSession на весь апдейт и User из кэша.
+    Хендлеры получают их через kwargs session и db_user.
+    Сессия ленивая — соединение из пула берётся только при первом запросе.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with AsyncSessionLocal() as session:
+            data["session"] = session
+            from_user = data.get("event_from_user")
+            data["db_user"] = await get_user_cached(session, str(from_user.id)) if from_user else None
+            return await handler(event, data)
+
+
+class FsmBatchMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на update: записи FSM за апдейт сбрасываются в БД одной транзакцией
+    на выходе из апдейта, а не по таймеру — к ответу на следующий апдейт шаг уже закоммичен.
+    Регистрируется раньше FSM-middleware aiogram и DbSessionMiddleware (см. main): тогда
+    чтение состояния попадает в батч, а сброс не ждёт второго соединения, пока сессия
+    апдейта держит своё.
+    """
+    def __init__(self, storage: SQLAlchemyStorage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with self.storage.batch():
+            return await handler(event, data)
+
+
+class RateLimitRequestMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: ответы хендлеров (answer, edit_text и т.п.) берут токен общего
+    лимитера в классе interactive. Отправки Mailer'а уже учтены под своим приоритетом.
+    """
+    def __init__(self, limiter: TelegramRateLimiter, priority: str = "interactive"):
+        self.limiter = limiter
+        self.priority = priority
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or rate_limited.get():
+            return await make_request(bot, method)
+        await self.limiter.acquire(chat_id, self.priority)
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.limiter.retry_after(chat_id, e.retry_after + 0.5)
+            raise
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: время работы каждого хендлера (метка — имя функции) и его исключения.
+    Регистрируется на наблюдателях диспетчера и действует на хендлеры всех вложенных роутеров.
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
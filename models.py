@@ -12,7 +12,7 @@ from sqlalchemy import (
     Boolean,
     TIMESTAMP,
     ForeignKey,
-    UniqueConstraint, DateTime, func
+    UniqueConstraint, DateTime, func, Index, Float, LargeBinary, SmallInteger, text
 )
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
@@ -33,7 +33,7 @@ class User(Base):
     tg_username = Column(String, nullable=True)
     role = Column(String, default="user")  # user | event_admin | super_admin
     name = Column(String, nullable=True)
-    created_at = Column(TIMESTAMP(timezone=True), default=datetime.now(UTC))
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
 
     events = relationship("Event", back_populates="owner", cascade="all, delete-orphan")
     registrations = relationship("Registration", back_populates="user", cascade="all, delete-orphan")
@@ -45,7 +45,7 @@ class Category(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     owner_id = Column(String, ForeignKey("users.tg_id"), nullable=True)  # NULL = глобальная категория
-    created_at = Column(TIMESTAMP(timezone=True), default=datetime.now(UTC))
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
 
     owner = relationship("User")
     events = relationship("Event", back_populates="category", cascade="all, delete-orphan")
@@ -53,6 +53,18 @@ class Category(Base):
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        # список событий админа: owner + сортировка/фильтр по publish_at
+        Index("ix_events_owner_publish_at", "owner_tg_id", "publish_at"),
+        # сверка планировщика: OR по трём датам, необязательные — частичными индексами
+        Index("ix_events_publish_at", "publish_at"),
+        Index("ix_events_reminder_at", "reminder_at",
+              postgresql_where=text("reminder_at IS NOT NULL"), sqlite_where=text("reminder_at IS NOT NULL")),
+        Index("ix_events_confirm_request_at", "confirm_request_at",
+              postgresql_where=text("confirm_request_at IS NOT NULL"),
+              sqlite_where=text("confirm_request_at IS NOT NULL")),
+        Index("ix_events_updated_at", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     owner_tg_id = Column(String, ForeignKey("users.tg_id"), nullable=False)
@@ -64,14 +76,15 @@ class Event(Base):
     confirm_request_at = Column(TIMESTAMP(timezone=True), nullable=True)
     confirm_text = Column(Text, nullable=True)
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
-    created_at = Column(TIMESTAMP(timezone=True), default=datetime.now(UTC))
-    updated_at = Column(TIMESTAMP(timezone=True), default=datetime.now(UTC), onupdate=datetime.now(UTC))
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
+    updated_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
 
     owner = relationship("User", back_populates="events")
     category = relationship("Category", back_populates="events")
     registrations = relationship("Registration", back_populates="event", cascade="all, delete-orphan")
     links = relationship("GeneratedLink", back_populates="event", cascade="all, delete-orphan")
     deeplink_tokens = relationship("DeepLinkToken", back_populates="event", cascade="all, delete-orphan")
+    due_items = relationship("DueItem", back_populates="event", cascade="all, delete-orphan")
 
 
 class Registration(Base):
@@ -88,7 +101,7 @@ class Registration(Base):
     company = Column(String, nullable=True)
     talk_topic = Column(Text, nullable=True)
     confirmed = Column(Boolean, default=False)
-    created_at = Column(TIMESTAMP(timezone=True), default=datetime.now(UTC))
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
 
     event = relationship("Event", back_populates="registrations")
     user = relationship("User", back_populates="registrations")
@@ -98,10 +111,10 @@ class GeneratedLink(Base):
     __tablename__ = "generated_links"
 
     id = Column(Integer, primary_key=True)
-    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"))
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), index=True)
     kind = Column(String, nullable=False)  # join | speaker | confirm
     payload = Column(Text, nullable=False)
-    created_at = Column(TIMESTAMP(timezone=True), default=datetime.now(UTC))
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
     expires_at = Column(TIMESTAMP(timezone=True), nullable=True)
 
     event = relationship("Event", back_populates="links")
@@ -109,6 +122,7 @@ class GeneratedLink(Base):
 
 class DeepLinkToken(Base):
     __tablename__ = "deeplink_tokens"
+    __table_args__ = (Index("ix_deeplink_tokens_event_expires", "event_id", "expires_at"),)
 
     token = Column(String(64), primary_key=True, default=lambda: uuid4().hex)
     kind = Column(String(16), nullable=False)  # join / speaker / confirm
@@ -119,6 +133,99 @@ class DeepLinkToken(Base):
     event = relationship("Event", back_populates="deeplink_tokens")
 
 
+class Broadcast(Base):
+    """Рассылка в outbox: текст один, получатели — строки BroadcastDelivery."""
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="SET NULL"), nullable=True)
+    kind = Column(String(16), nullable=False)  # poster | reminder | confirm | manual
+    text = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending | paused | cancelled | done
+    created_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
+    finished_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    # сообщение админа, в котором показывается прогресс рассылки и кнопки управления
+    report_chat_id = Column(String, nullable=True)
+    report_message_id = Column(Integer, nullable=True)
+
+    deliveries = relationship("BroadcastDelivery", back_populates="broadcast", cascade="all, delete-orphan")
+
+
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+    __table_args__ = (
+        UniqueConstraint("broadcast_id", "chat_id", name="uq_broadcast_chat"),
+        Index("ix_broadcast_deliveries_status_priority_id", "status", "priority", "id"),
+    )
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(String, nullable=False)
+    priority = Column(SmallInteger, nullable=False, default=1, server_default="1")  # 0 urgent | 1 bulk
+    status = Column(String(16), nullable=False, default="pending")  # pending | sending | sent | failed | blocked | cancelled
+    attempts = Column(Integer, nullable=False, default=0)
+    claimed_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    sent_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    broadcast = relationship("Broadcast", back_populates="deliveries")
+
+
+class DueItem(Base):
+    """Запланированное действие по событию: публикация, напоминание, запрос подтверждения."""
+    __tablename__ = "due_items"
+    __table_args__ = (
+        UniqueConstraint("event_id", "kind", name="uq_due_event_kind"),
+        Index("ix_due_items_pending_due_at", "due_at",
+              postgresql_where=text("fired_at IS NULL"), sqlite_where=text("fired_at IS NULL")),
+    )
+
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(16), nullable=False)  # publish | reminder | confirm
+    due_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    # взято диспетчером (аренда); fired_at — только после успешного хендлера
+    claimed_at = Column(TIMESTAMP(timezone=True), nullable=True)
+    fired_at = Column(TIMESTAMP(timezone=True), nullable=True)
+
+    event = relationship("Event", back_populates="due_items")
+
+
+class FsmState(Base):
+    """Состояние и данные FSM aiogram (см. fsm_storage.SQLAlchemyStorage)."""
+    __tablename__ = "fsm_states"
+
+    key = Column(String(255), primary_key=True)  # fsm:{bot_id}:{chat_id}:{user_id}
+    state = Column(String(255), nullable=True)
+    data = Column(Text, nullable=False, default="{}")  # JSON
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+
+
+class BlockedRecipient(Base):
+    """Получатели, которым Telegram не доставляет сообщения: заблокировали бота или чат не найден."""
+    __tablename__ = "blocked_recipients"
+
+    chat_id = Column(String, primary_key=True)
+    reason = Column(String(32), nullable=False)  # blocked | chat_not_found
+    blocked_at = Column(TIMESTAMP(timezone=True), default=lambda: datetime.now(UTC))
+
+
+class SchedulerJob(Base):
+    """Сериализованные задачи APScheduler (см. jobstore.PersistentJobStore)."""
+    __tablename__ = "scheduler_jobs"
+
+    id = Column(String(191), primary_key=True)
+    next_run_time = Column(Float, nullable=True, index=True)
+    job_state = Column(LargeBinary, nullable=False)
+
+
+class SchedulerMeta(Base):
+    """Служебные отметки планировщика, например время последней сверки событий."""
+    __tablename__ = "scheduler_meta"
+
+    key = Column(String(64), primary_key=True)
+    value = Column(TIMESTAMP(timezone=True), nullable=True)
+
+
 # --- вспомогательные функции ---
 async def init_db():
     """
@@ -0,0 +1,375 @@
+import asyncio
+import logging
+import weakref
+from datetime import datetime, timedelta, UTC
+from typing import Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from sqlalchemy import select, update, insert, literal, exists, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crud import recipient_ids_query, suppress_recipients, filter_suppressed
+from keyboards import broadcast_control_kb
+from mailer import Mailer
+from metrics import MAILER_WINDOW
+from models import AsyncSessionLocal, Broadcast, BroadcastDelivery
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+# приоритет доставок: напоминания и подтверждения идут своей полосой, не дожидаясь массовых рассылок
+URGENT, BULK = 0, 1
+LANES = {URGENT: "urgent", BULK: "bulk"}
+URGENT_KINDS = ("reminder", "confirm")
+
+# действие админа -> (из каких статусов рассылки допустимо, в какой переводит)
+CONTROL_ACTIONS = {
+    "pause": (("pending",), "paused"),
+    "resume": (("paused",), "pending"),
+    "cancel": (("pending", "paused"), "cancelled"),
+}
+STATUS_TITLES = {"pending": "идёт", "paused": "на паузе", "cancelled": "отменена", "done": "завершена"}
+
+# будим воркер сразу после постановки рассылки, не дожидаясь poll_interval
+_wakeups = {lane: asyncio.Event() for lane in LANES}
+
+
+def notify():
+    for wakeup in _wakeups.values():
+        wakeup.set()
+
+
+def priority_for(kind: str) -> int:
+    return URGENT if kind in URGENT_KINDS else BULK
+
+
+def _new_broadcast(kind: str, text: str, event_id: Optional[int], report_to: Optional[tuple]) -> Broadcast:
+    bc = Broadcast(event_id=event_id, kind=kind, text=text)
+    if report_to is not None:
+        bc.report_chat_id, bc.report_message_id = str(report_to[0]), report_to[1]
+    return bc
+
+
+def _finish_if_empty(bc: Broadcast, total: int):
+    """Рассылку без получателей воркер никогда не заберёт — завершаем её в той же транзакции."""
+    if total == 0:
+        bc.status = "done"
+        bc.finished_at = datetime.now(UTC)
+
+
+async def enqueue_broadcast(session: AsyncSession, text: str, chat_ids: Iterable, kind: str = "manual",
+                            event_id: Optional[int] = None, report_to: Optional[tuple] = None) -> tuple[Broadcast, int]:
+    """
+    Поставить рассылку явному списку получателей. Возвращает (broadcast, число получателей).
+    Заблокировавшие бота отбрасываются. report_to — (chat_id, message_id) сообщения,
+    в котором воркер будет показывать прогресс.
+    """
+    bc = _new_broadcast(kind, text, event_id, report_to)
+    session.add(bc)
+    await session.flush()
+    priority = priority_for(kind)
+
+    async def insert_chunk(chunk: list[str]) -> int:
+        chunk = await filter_suppressed(session, chunk)
+        if chunk:
+            await session.execute(insert(BroadcastDelivery), [
+                {"broadcast_id": bc.id, "chat_id": chat_id, "priority": priority} for chat_id in chunk
+            ])
+        return len(chunk)
+
+    total = 0
+    chunk = []
+    for chat_id in dict.fromkeys(str(c) for c in chat_ids):
+        chunk.append(chat_id)
+        if len(chunk) >= CHUNK_SIZE:
+            total += await insert_chunk(chunk)
+            chunk = []
+    if chunk:
+        total += await insert_chunk(chunk)
+
+    _finish_if_empty(bc, total)
+    await session.commit()
+    if total:
+        notify()
+    logger.info("Enqueued %s broadcast %s for %s recipients", kind, bc.id, total)
+    return bc, total
+
+
+async def enqueue_event_broadcast(session: AsyncSession, event_id: int, text: str, kind: str = "manual",
+                                  role_filter: Optional[str] = None,
+                                  report_to: Optional[tuple] = None) -> tuple[Broadcast, int]:
+    """Поставить рассылку всем зарегистрированным на событие одним INSERT ... SELECT."""
+    bc = _new_broadcast(kind, text, event_id, report_to)
+    session.add(bc)
+    await session.flush()
+
+    recipients = recipient_ids_query(event_id, role_filter).add_columns(literal(bc.id), literal(priority_for(kind)))
+    result = await session.execute(
+        insert(BroadcastDelivery).from_select(["chat_id", "broadcast_id", "priority"], recipients)
+    )
+    total = result.rowcount
+
+    _finish_if_empty(bc, total)
+    await session.commit()
+    if total:
+        notify()
+    logger.info("Enqueued %s broadcast %s for event %s (%s recipients)", kind, bc.id, event_id, total)
+    return bc, total
+
+
+async def control_broadcast(session: AsyncSession, broadcast_id: int, action: str,
+                            owner_chat_id) -> Optional[str]:
+    """
+    Пауза, продолжение или отмена рассылки из чата, где показывается её прогресс.
+    Возвращает новый статус или None, если переход невозможен (рассылка уже завершена,
+    статус не подходит или чат чужой). Доставки, уже взятые воркером, дойдут до конца.
+    """
+    allowed, target = CONTROL_ACTIONS[action]
+    result = await session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id, Broadcast.status.in_(allowed),
+               Broadcast.report_chat_id == str(owner_chat_id))
+        .values(status=target, finished_at=datetime.now(UTC) if target == "cancelled" else None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        await session.rollback()
+        return None
+    if target == "cancelled":
+        await session.execute(
+            update(BroadcastDelivery)
+            .where(BroadcastDelivery.broadcast_id == broadcast_id, BroadcastDelivery.status == "pending")
+            .values(status="cancelled")
+            .execution_options(synchronize_session=False)
+        )
+    await session.commit()
+    if target == "pending":
+        notify()
+    logger.info("Broadcast %s %s by %s", broadcast_id, target, owner_chat_id)
+    return target
+
+
+async def broadcast_progress(session: AsyncSession, broadcast_id: int) -> Optional[tuple[Broadcast, dict]]:
+    """Рассылка и число её доставок по статусам."""
+    bc = await session.get(Broadcast, broadcast_id, populate_existing=True)
+    if bc is None:
+        return None
+    q = await session.execute(
+        select(BroadcastDelivery.status, func.count())
+        .where(BroadcastDelivery.broadcast_id == broadcast_id)
+        .group_by(BroadcastDelivery.status)
+    )
+    return bc, dict(q.all())
+
+
+def display_status(bc: Broadcast, counts: dict) -> str:
+    """Статус для показа админу: рассылка без единой доставки уже завершена, что бы ни было в строке."""
+    if not counts and bc.status in ("pending", "paused"):
+        return "done"
+    return bc.status
+
+
+def format_progress(bc: Broadcast, counts: dict) -> str:
+    total = sum(counts.values())
+    status = display_status(bc, counts)
+    lines = [
+        f"📨 Рассылка #{bc.id}: {STATUS_TITLES.get(status, status)}",
+        f"Отправлено: {counts.get('sent', 0)} из {total}",
+        f"Не доставлено: {counts.get('failed', 0) + counts.get('blocked', 0)}"
+        f" (заблокировали бота: {counts.get('blocked', 0)})",
+    ]
+    if counts.get("cancelled"):
+        lines.append(f"Отменено: {counts['cancelled']}")
+    return "\n".join(lines)
+
+
+class ProgressReporter:
+    """
+    Показывает прогресс рассылок в сообщении админа. Воркер только отмечает затронутые
+    рассылки, а сообщения правятся раз в interval секунд — не чаще, сколько бы пачек
+    ни ушло за это время. Финальный статус показывается той же правкой.
+    """
+    def __init__(self, bot: Bot, interval: float = 3.0):
+        self.bot = bot
+        self.interval = interval
+        self._dirty: set[int] = set()
+        self._shown: dict[int, str] = {}
+
+    def touch(self, broadcast_ids: Iterable[int]):
+        self._dirty.update(broadcast_ids)
+
+    async def report(self):
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        async with AsyncSessionLocal() as session:
+            for broadcast_id in dirty:
+                progress = await broadcast_progress(session, broadcast_id)
+                if progress is None or progress[0].report_message_id is None:
+                    continue
+                bc, counts = progress
+                text = format_progress(bc, counts)
+                if self._shown.get(bc.id) == text:
+                    continue
+                try:
+                    await self.bot.edit_message_text(
+                        text=text, chat_id=bc.report_chat_id, message_id=bc.report_message_id,
+                        reply_markup=broadcast_control_kb(bc.id, display_status(bc, counts)),
+                    )
+                except TelegramBadRequest as e:
+                    if "message is not modified" not in str(e):
+                        logger.warning("Cannot update progress of broadcast %s: %s", bc.id, e)
+                except TelegramAPIError as e:
+                    logger.warning("Cannot update progress of broadcast %s: %s", bc.id, e)
+                if bc.status in CONTROL_ACTIONS["cancel"][0]:
+                    self._shown[bc.id] = text
+                else:
+                    self._shown.pop(bc.id, None)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.report()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Broadcast progress update failed")
+
+
+def _window_gauge(mailer: Mailer):
+    """Источник гейджа mailer_window_size, который не удерживает Mailer (и воркер) в памяти."""
+    ref = weakref.ref(mailer)
+
+    def size() -> int:
+        m = ref()
+        return m.window_size if m is not None else 0
+    return size
+
+
+class OutboxWorker:
+    """
+    Разбирает outbox: забирает pending-доставки пачками (FOR UPDATE SKIP LOCKED на Postgres,
+    на SQLite атомарность даёт блокировка записи), отправляет через Mailer и пишет исход.
+    Доставки в статусе sending, чья аренда (lease) истекла, считаются брошенными упавшим
+    процессом и забираются снова — после рестарта рассылка продолжается с того же места.
+    Каждая полоса приоритета (LANES) разбирается своим циклом и своим Mailer'ом,
+    а общий лимитер делит между ними бюджет Telegram по весам.
+    Доставки рассылок на паузе или отменённых не забираются; прогресс показывает ProgressReporter.
+    """
+    def __init__(self, bot: Bot, batch_size: int = 100, concurrency: int = 10,
+                 poll_interval: float = 5.0, lease: float = 300.0, adaptive: bool = False,
+                 progress_interval: float = 3.0):
+        self.mailers = {
+            lane: Mailer(bot, concurrency=concurrency, adaptive=adaptive, max_concurrency=batch_size, priority=name)
+            for lane, name in LANES.items()
+        }
+        for lane, name in LANES.items():
+            MAILER_WINDOW.set_function(_window_gauge(self.mailers[lane]), name)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease)
+        self.progress = ProgressReporter(bot, progress_interval)
+        self._tasks: list[asyncio.Task] = []
+
+    async def claim_batch(self, session: AsyncSession, priority: int = BULK) -> list:
+        now = datetime.now(UTC)
+        candidates = (
+            select(BroadcastDelivery.id)
+            .where(BroadcastDelivery.priority == priority, or_(
+                BroadcastDelivery.status == "pending",
+                and_(BroadcastDelivery.status == "sending", BroadcastDelivery.claimed_at < now - self.lease),
+            ), BroadcastDelivery.broadcast_id.in_(select(Broadcast.id).where(Broadcast.status == "pending")))
+            .order_by(BroadcastDelivery.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        result = await session.execute(
+            update(BroadcastDelivery)
+            .where(BroadcastDelivery.id.in_(candidates.scalar_subquery()))
+            .values(status="sending", claimed_at=now, attempts=BroadcastDelivery.attempts + 1)
+            .returning(BroadcastDelivery.id, BroadcastDelivery.broadcast_id, BroadcastDelivery.chat_id)
+            .execution_options(synchronize_session=False)
+        )
+        rows = result.all()
+        await session.commit()
+        return rows
+
+    async def process_batch(self, priority: int = BULK) -> int:
+        mailer = self.mailers[priority]
+        async with AsyncSessionLocal() as session:
+            rows = await self.claim_batch(session, priority)
+            if not rows:
+                return 0
+
+            broadcast_ids = {r.broadcast_id for r in rows}
+            q = await session.execute(select(Broadcast.id, Broadcast.text).where(Broadcast.id.in_(broadcast_ids)))
+            texts = dict(q.all())
+
+            outcomes = await asyncio.gather(*(
+                mailer.deliver(r.chat_id, texts[r.broadcast_id]) for r in rows
+            ))
+
+            by_status: dict[str, list[int]] = {}
+            for r, status in zip(rows, outcomes):
+                by_status.setdefault(status, []).append(r.id)
+            now = datetime.now(UTC)
+            for status, ids in by_status.items():
+                await session.execute(
+                    update(BroadcastDelivery)
+                    .where(BroadcastDelivery.id.in_(ids))
+                    .values(status=status, sent_at=now if status == "sent" else None)
+                    .execution_options(synchronize_session=False)
+                )
+            # недоступные чаты больше не попадут в рассылки
+            await suppress_recipients(session, mailer.pop_blocked())
+
+            unfinished = exists().where(
+                BroadcastDelivery.broadcast_id == Broadcast.id,
+                BroadcastDelivery.status.in_(("pending", "sending")),
+            )
+            # поставленная на паузу рассылка тоже завершается, если пауза пришла на последней пачке
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id.in_(broadcast_ids), Broadcast.status.in_(("pending", "paused")), ~unfinished)
+                .values(status="done", finished_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            self.progress.touch(broadcast_ids)
+            return len(rows)
+
+    async def run(self, priority: int = BULK):
+        logger.info("Outbox worker started (%s lane)", LANES[priority])
+        wakeup = _wakeups[priority]
+        while True:
+            wakeup.clear()
+            try:
+                if await self.process_batch(priority):
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox worker iteration failed (%s lane)", LANES[priority])
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self._tasks or all(task.done() for task in self._tasks):
+            self._tasks = [asyncio.create_task(self.run(lane)) for lane in LANES]
+            self._tasks.append(asyncio.create_task(self.progress.run()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            # последние счётчики, накопленные до остановки
+            await self.progress.report()
+        except Exception:
+            logger.exception("Broadcast progress update failed")
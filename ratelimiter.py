@@ -0,0 +1,242 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, в запасе не больше capacity.
+    pause(seconds) замораживает бакет — после паузы он начинает наполняться с нуля.
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Взять токен. Возвращает 0, если токен взят, иначе сколько секунд подождать."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            self.updated = until
+            self.tokens = 0.0
+
+    def refund(self):
+        """Вернуть взятый, но не использованный токен."""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def idle(self) -> bool:
+        """Бакет полон и не на паузе — его можно выбросить без потери информации."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        while (delay := self.reserve()) > 0:
+            await asyncio.sleep(delay)
+
+
+# доля глобального бюджета при конкуренции: ответы пользователям > напоминания/подтверждения > массовые рассылки
+PRIORITY_WEIGHTS = {"interactive": 16.0, "urgent": 4.0, "bulk": 1.0}
+
+# Mailer сам берёт токен под свой приоритет — middleware сессии бота его пропускает
+rate_limited: ContextVar[bool] = ContextVar("rate_limited", default=False)
+
+
+class TelegramRateLimiter:
+    """
+    Общий на процесс лимитер отправки в Telegram:
+      - глобально не больше global_rate сообщений в секунду;
+      - в личный чат ~1 сообщение в секунду, но с запасом на private_burst подряд:
+        хендлер отвечает на одно действие пользователя несколькими сообщениями, и ждать
+        секунду перед вторым незачем — Telegram короткие всплески в личку пропускает;
+      - в группу/канал не больше 20 сообщений в минуту.
+    Бакеты чатов живут в LRU и выбрасываются, когда снова полны.
+
+    Глобальный бюджет делится между классами приоритета (PRIORITY_WEIGHTS) взвешенной
+    справедливой очередью: когда токенов не хватает, ожидающие получают их в порядке
+    виртуального времени завершения, так что при конкуренции interactive получает
+    в 16 раз больше токенов, чем bulk, но и bulk не голодает.
+    """
+    def __init__(self, global_rate: float = 30.0, private_rate: float = 1.0, private_burst: int = 3,
+                 group_rate: float = 20 / 60, max_chats: int = 10_000,
+                 weights: dict[str, float] | None = None):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.max_chats = max_chats
+        self.weights = weights or PRIORITY_WEIGHTS
+        self._chats: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._waiters: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._lane_tags: dict[str, float] = {}
+        self._granter: asyncio.Task | None = None
+
+    @staticmethod
+    def is_group(chat_id) -> bool:
+        # id групп и каналов отрицательные, публичные каналы можно адресовать через @username
+        return str(chat_id).startswith(("-", "@"))
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self._chats.get(key)
+        if bucket is not None:
+            self._chats.move_to_end(key)
+            return bucket
+        if self.is_group(key):
+            bucket = TokenBucket(self.group_rate)
+        else:
+            bucket = TokenBucket(self.private_rate, capacity=self.private_burst)
+        self._chats[key] = bucket
+        while len(self._chats) > self.max_chats:
+            oldest_key, oldest = next(iter(self._chats.items()))
+            if not oldest.idle():
+                break
+            del self._chats[oldest_key]
+        return bucket
+
+    async def acquire(self, chat_id, priority: str = "bulk"):
+        """Дождаться права отправить одно сообщение в chat_id."""
+        # сначала лимит чата: пока ждём его, не занимаем глобальный бюджет
+        await self._chat_bucket(chat_id).acquire()
+        await self._acquire_global(priority)
+
+    async def _acquire_global(self, priority: str):
+        # быстрый путь: очереди нет и токен есть
+        if not self._waiters and self.global_bucket.reserve() == 0:
+            return
+        tag = max(self._vtime, self._lane_tags.get(priority, 0.0)) + 1 / self.weights[priority]
+        self._lane_tags[priority] = tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (tag, next(self._seq), future))
+        if self._granter is None or self._granter.done():
+            self._granter = asyncio.create_task(self._grant())
+        await future
+
+    async def _grant(self):
+        """Раздаёт глобальные токены ожидающим по возрастанию виртуального времени."""
+        while self._waiters:
+            delay = self.global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            while self._waiters:
+                tag, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    self._vtime = tag
+                    future.set_result(None)
+                    break
+            else:
+                # все дождавшиеся отменились — токен не пропадает
+                self.global_bucket.refund()
+
+    def retry_after(self, chat_id, seconds: float):
+        """
+        Telegram ответил 429. Лимит чата для личек мы соблюдаем сами, значит
+        превышен глобальный — ставим на паузу всех. Для групп виноват лимит группы.
+        """
+        if self.is_group(chat_id):
+            self._chat_bucket(chat_id).pause(seconds)
+        else:
+            self.global_bucket.pause(seconds)
+
+
+class AIMDWindow:
+    """
+    Адаптивное окно одновременных отправок (AIMD, как окно TCP):
+      - пока ответы быстрые (latency <= latency_target), окно растёт на increase
+        за каждый "круг" успешных отправок (+increase/limit на каждую);
+      - на 429, таймауте или медленном ответе окно умножается на decrease,
+        но не чаще раза в cooldown секунд — одна перегрузка даёт пачку ошибок сразу.
+    Используется как async context manager вместо asyncio.Semaphore. Ожидающие встают
+    в FIFO-очередь, и освободившийся слот будит ровно одного — без notify_all на всю очередь.
+    """
+    def __init__(self, initial: int = 10, min_limit: int = 1, max_limit: int = 100,
+                 increase: float = 1.0, decrease: float = 0.5,
+                 latency_target: float = 1.0, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def size(self) -> int:
+        return int(self.limit)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.size:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def __aenter__(self):
+        if not self._waiters and self.in_flight < self.size:
+            self.in_flight += 1
+            return self
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # слот успели выдать, а задачу отменили — вернуть его следующему
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self, latency: float):
+        if latency > self.latency_target:
+            self.on_congestion()
+            return
+        # растём, только когда окно действительно выбрано — иначе размер ничего не говорит
+        if self.in_flight >= self.size - 1:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._wake()
+
+    def on_congestion(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.decreases += 1
+
+
+limiter = TelegramRateLimiter(global_rate=float(os.getenv("TG_GLOBAL_RATE", "30")))
@@ -3,20 +3,26 @@ import os
 from datetime import datetime, timezone
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
-from aiogram import Bot
 from dotenv import load_dotenv
 
 from models import AsyncSessionLocal
-from crud import get_event, get_events_for_scheduler, get_registrations_for_event, save_generated_link
-from utils import make_deeplink
-from mailer import Mailer
+from crud import (
+    get_event, get_events_for_scheduler, get_events_changed_since, add_generated_links, sync_due_items,
+    sync_due_items_bulk, has_recipients,
+)
+from due_dispatcher import notify
+from jobstore import PersistentJobStore, get_marker, set_marker
+from utils import make_deeplinks
+from outbox import enqueue_broadcast, enqueue_event_broadcast
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# когда init_scheduler последний раз сверял события с due_items
+RECONCILE_MARKER = "events_reconciled_at"
 
-async def send_poster_job(event_id: int, bot: Bot):
+
+async def send_poster_job(event_id: int):
     async with AsyncSessionLocal() as session:
         ev = await get_event(session, event_id)
         if not ev:
@@ -24,118 +30,104 @@ async def send_poster_job(event_id: int, bot: Bot):
             return
 
         bot_username = os.getenv("BOT_USERNAME", "")
-        join_link = make_deeplink("join", ev.id, bot_username)
-        speaker_link = make_deeplink("speaker", ev.id, bot_username)
+        # токены уйдут в БД одной транзакцией с постановкой рассылки
+        links = await make_deeplinks(("join", "speaker"), ev.id, bot_username, session)
+        join_link, speaker_link = links["join"], links["speaker"]
 
         text = f"{ev.poster_text}\n\nРегистрация слушателей: {join_link}\nРегистрация докладчиков: {speaker_link}"
 
-        mailer = Mailer(bot, concurrency=10)
-
-        # Отправляем владельцу события
-        owner_chat = ev.owner.tg_id if getattr(ev, "owner", None) else None
-        if owner_chat:
-            await mailer.send_batch([owner_chat], text)
-            logger.info("Sent preview to owner of event %s", event_id)
-
-        # Отправляем в канал/группу BROADCAST_CHAT_ID
+        # Владельцу события — превью, в канал/группу BROADCAST_CHAT_ID — публикация
+        chat_ids = [ev.owner_tg_id]
         broadcast = os.getenv("BROADCAST_CHAT_ID")
         if broadcast:
             try:
-                broadcast_id = int(broadcast)
-                await mailer.send_batch([broadcast_id], text, disable_notification=False)
-                logger.info("Published event %s to broadcast %s", event_id, broadcast_id)
+                chat_ids.append(int(broadcast))
             except ValueError:
                 logger.warning("BROADCAST_CHAT_ID not an int: %s", broadcast)
 
+        await enqueue_broadcast(session, text, chat_ids, kind="poster", event_id=ev.id)
+        logger.info("Enqueued poster of event %s to %s", event_id, chat_ids)
+
 
-async def send_reminder_job(event_id: int, bot: Bot):
+async def send_reminder_job(event_id: int):
     async with AsyncSessionLocal() as session:
         ev = await get_event(session, event_id)
         if not ev or not ev.reminder_text:
             return
-
-        regs = await get_registrations_for_event(session, event_id)
-        if not regs:
+        if not await has_recipients(session, event_id):
             return
 
-        mailer = Mailer(bot, concurrency=10)
-        chat_ids = [r.tg_id for r in regs]
-        await mailer.send_batch(chat_ids, ev.reminder_text)
-        logger.info("Sent reminder for event %s to %s users", event_id, len(chat_ids))
+        _, total = await enqueue_event_broadcast(session, event_id, ev.reminder_text, kind="reminder")
+        logger.info("Enqueued reminder for event %s to %s users", event_id, total)
 
 
-async def send_confirm_request_job(event_id: int, bot: Bot):
+async def send_confirm_request_job(event_id: int):
     async with AsyncSessionLocal() as session:
         ev = await get_event(session, event_id)
         if not ev or not ev.confirm_text:
             return
-
-        regs = await get_registrations_for_event(session, event_id)
-        if not regs:
+        if not await has_recipients(session, event_id):
             return
 
         bot_username = os.getenv("BOT_USERNAME", "")
-        confirm_link = await make_deeplink("confirm", ev.id, bot_username, session)
-        await save_generated_link(session, ev.id, "confirm", confirm_link)
+        links = await make_deeplinks(("confirm",), ev.id, bot_username, session)
+        confirm_link = links["confirm"]
+        # токен, ссылка и рассылка коммитятся вместе в enqueue_event_broadcast
+        await add_generated_links(session, ev.id, links)
 
         text = f"{ev.confirm_text}\nПодтвердить участие: {confirm_link}"
 
-        mailer = Mailer(bot, concurrency=10)
-        chat_ids = [r.tg_id for r in regs]
-        await mailer.send_batch(chat_ids, text)
-        logger.info("Sent confirm requests for event %s", event_id)
+        _, total = await enqueue_event_broadcast(session, event_id, text, kind="confirm")
+        logger.info("Enqueued confirm requests for event %s to %s users", event_id, total)
 
 
-async def schedule_event_jobs_for_event(ev, bot: Bot, scheduler: AsyncIOScheduler):
-    """Добавляем job'ы для события, если даты в будущем"""
-    now = datetime.now(timezone.utc)
+async def send_broadcast_job(event_id: int, text: str):
+    """Отложенная ручная рассылка из админки: получатели берутся на момент отправки"""
+    async with AsyncSessionLocal() as session:
+        if not await has_recipients(session, event_id):
+            logger.info("Scheduled broadcast for event %s skipped: no recipients", event_id)
+            return
+        _, total = await enqueue_event_broadcast(session, event_id, text, kind="manual")
+        logger.info("Enqueued scheduled broadcast for event %s to %s users", event_id, total)
+
+
+async def schedule_event_jobs_for_event(ev, session):
+    """Планируем действия события (публикация, напоминание, подтверждение) в due_items"""
+    planned = await sync_due_items(session, ev, datetime.now(timezone.utc))
+    await session.commit()
+    notify()
+    logger.info("Planned %s due items for event %s", planned, ev.id)
+
 
-    if ev.publish_at and ev.publish_at > now:
-        scheduler.add_job(
-            send_poster_job,
-            trigger=DateTrigger(run_date=ev.publish_at),
-            args=(ev.id, bot),
-            id=f"event_{ev.id}_publish",
-            replace_existing=True
-        )
-        logger.info("Scheduled publish for event %s at %s", ev.id, ev.publish_at)
-
-    if ev.reminder_at and ev.reminder_at > now:
-        scheduler.add_job(
-            send_reminder_job,
-            trigger=DateTrigger(run_date=ev.reminder_at),
-            args=(ev.id, bot),
-            id=f"event_{ev.id}_reminder",
-            replace_existing=True
-        )
-        logger.info("Scheduled reminder for event %s at %s", ev.id, ev.reminder_at)
-
-    if ev.confirm_request_at and ev.confirm_request_at > now:
-        scheduler.add_job(
-            send_confirm_request_job,
-            trigger=DateTrigger(run_date=ev.confirm_request_at),
-            args=(ev.id, bot),
-            id=f"event_{ev.id}_confirm",
-            replace_existing=True
-        )
-        logger.info("Scheduled confirm request for event %s at %s", ev.id, ev.confirm_request_at)
-
-
-async def init_scheduler(bot: Bot, scheduler: AsyncIOScheduler):
-    """Инициализация: считываем все события с будущими датами и планируем их"""
+# kind из due_items -> job
+EVENT_JOBS = {
+    "publish": send_poster_job,
+    "reminder": send_reminder_job,
+    "confirm": send_confirm_request_job,
+}
+
+
+async def init_scheduler(scheduler: AsyncIOScheduler, jobstore: PersistentJobStore):
+    """
+    Инициализация (на лидере): поднимаем сохранённые задачи из jobstore (ручные рассылки)
+    и сверяем due_items только для событий, созданных/изменённых с прошлого запуска.
+    Полный проход — только при первом старте.
+    """
     logger.info("Initializing scheduler...")
+    now = datetime.now(timezone.utc)
+    await jobstore.reload(scheduler)
+    # задачи событий раньше жили в APScheduler — теперь их срабатывает DueDispatcher
+    for job in jobstore.get_all_jobs():
+        if job.id.startswith("event_"):
+            jobstore.remove_job(job.id)
+    since = await get_marker(RECONCILE_MARKER)
     async with AsyncSessionLocal() as session:
-        now = datetime.now(timezone.utc)
-        events = await get_events_for_scheduler(session, now)
-        for ev in events:
-            await schedule_event_jobs_for_event(ev, bot, scheduler)
-    logger.info("Scheduler init done.")
-
-
-def remove_event_jobs(event_id: int, scheduler: AsyncIOScheduler):
-    """Удаляем джобы события"""
-    for kind in ("publish", "reminder", "confirm"):
-        job_id = f"event_{event_id}_{kind}"
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-            logger.info("Removed job %s", job_id)
+        if since is None:
+            events = await get_events_for_scheduler(session, now)
+        else:
+            events = await get_events_changed_since(session, since)
+        await sync_due_items_bulk(session, events, now)
+        await session.commit()
+    notify()
+    await set_marker(RECONCILE_MARKER, now)
+    logger.info("Scheduler init done, reconciled %s events.", len(events))
@@ -1,31 +1,127 @@
+import base64
+import hashlib
+import hmac
 import os
+import struct
 from datetime import datetime, UTC
 from urllib.parse import quote
+from uuid import uuid4
 
 from dotenv import load_dotenv
-from sqlalchemy import select
+from sqlalchemy import select, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from cache import payload_cache, MISSING
 from models import DeepLinkToken
 
 load_dotenv()
 SECRET = os.environ["SECRET_KEY"].encode()
+# выдавать подписанные токены вместо строк в deeplink_tokens
+SIGNED_DEEPLINKS = os.getenv("SIGNED_DEEPLINKS", "").lower() in ("1", "true", "yes")
+
+# Подписанный токен: "s" + base64url(header | event_id | expires | [recipient] | mac).
+# header: младшие 4 бита — kind, бит 4 — есть recipient. expires — unix-время, 0 = бессрочно.
+# Итого 29 символов без получателя и 40 с ним — в пределах 64 символов параметра /start.
+SIGNED_PREFIX = "s"
+# сколько помнить, что токена нет в БД
+NEGATIVE_TTL = 30.0
+_KINDS = {"join": 1, "speaker": 2, "confirm": 3}
+_KIND_NAMES = {code: kind for kind, code in _KINDS.items()}
+_HAS_RECIPIENT = 0x10
+_MAC_SIZE = 12
+
+
+def _mac(body: bytes) -> bytes:
+    return hmac.new(SECRET, body, hashlib.sha256).digest()[:_MAC_SIZE]
+
+
+def make_signed_token(kind: str, event_id: int, expires_at: datetime | None = None,
+                      recipient_id: int | None = None) -> str:
+    """
+    Токен, который проверяется по SECRET без обращения к БД.
+    Отозвать его нельзя — только истечением expires_at или сменой SECRET_KEY.
+    """
+    header = _KINDS[kind]
+    expires = int(expires_at.timestamp()) if expires_at else 0
+    body = struct.pack(">BII", header | (_HAS_RECIPIENT if recipient_id else 0), event_id, expires)
+    if recipient_id:
+        body += struct.pack(">Q", int(recipient_id))
+    return SIGNED_PREFIX + base64.urlsafe_b64encode(body + _mac(body)).rstrip(b"=").decode()
+
+
+def verify_signed_token(token: str) -> dict | None:
+    encoded = token[len(SIGNED_PREFIX):]
+    try:
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except ValueError:
+        return None
+    body, mac = raw[:-_MAC_SIZE], raw[-_MAC_SIZE:]
+    if len(body) not in (9, 17) or not hmac.compare_digest(mac, _mac(body)):
+        return None
+    header, event_id, expires = struct.unpack(">BII", body[:9])
+    kind = _KIND_NAMES.get(header & 0x0F)
+    if kind is None:
+        return None
+    if expires and expires < datetime.now(UTC).timestamp():
+        return None
+    payload = {"kind": kind, "event_id": event_id}
+    if header & _HAS_RECIPIENT:
+        if len(body) != 17:
+            return None
+        payload["recipient_id"] = struct.unpack(">Q", body[9:])[0]
+    return payload
 
 
 async def verify_payload(token: str, session: AsyncSession) -> dict | None:
+    if token.startswith(SIGNED_PREFIX):
+        return verify_signed_token(token)
+    # fallback: старые токены из deeplink_tokens, через кэш
+    cached = payload_cache.get(token, MISSING)
+    if cached is not MISSING:
+        return cached
     q = await session.execute(select(DeepLinkToken).where(DeepLinkToken.token == token))
     obj = q.scalar_one_or_none()
     if not obj:
+        payload_cache.set(token, None, ttl=NEGATIVE_TTL)
         return None
-    if obj.expires_at and obj.expires_at < datetime.now(UTC):
-        return None
-    return {"kind": obj.kind, "event_id": obj.event_id}
+    ttl = None
+    if obj.expires_at:
+        ttl = (obj.expires_at.replace(tzinfo=obj.expires_at.tzinfo or UTC) - datetime.now(UTC)).total_seconds()
+        if ttl <= 0:
+            payload_cache.set(token, None)
+            return None
+    payload = {"kind": obj.kind, "event_id": obj.event_id}
+    # запись живёт не дольше самого токена
+    payload_cache.set(token, payload, ttl=ttl)
+    return payload
+
+
+def invalidate_event_payloads(event_id: int):
+    payload_cache.invalidate_where(lambda token, payload: payload is not None and payload["event_id"] == event_id)
+
+
+def _start_link(bot_username: str, token: str) -> str:
+    return f"https://t.me/{bot_username}_bot?start={quote(token)}"
+
+
+async def make_deeplinks(kinds, event_id: int, bot_username: str, session: AsyncSession,
+                         expires_at=None, signed: bool | None = None) -> dict[str, str]:
+    """
+    Создаёт токены сразу для нескольких kind одним multi-row INSERT.
+    Не коммитит — токены попадают в транзакцию вызывающего кода.
+    signed (по умолчанию SIGNED_DEEPLINKS): подписанные токены, в БД ничего не пишется.
+    """
+    if SIGNED_DEEPLINKS if signed is None else signed:
+        return {kind: _start_link(bot_username, make_signed_token(kind, event_id, expires_at)) for kind in kinds}
+    tokens = {kind: uuid4().hex for kind in kinds}
+    await session.execute(insert(DeepLinkToken), [
+        {"token": token, "kind": kind, "event_id": event_id, "expires_at": expires_at}
+        for kind, token in tokens.items()
+    ])
+    return {kind: _start_link(bot_username, token) for kind, token in tokens.items()}
 
 
 async def make_deeplink(kind: str, event_id: int, bot_username: str, session: AsyncSession, expires_at=None) -> str:
-    token = DeepLinkToken(kind=kind, event_id=event_id, expires_at=expires_at)
-    session.add(token)
+    links = await make_deeplinks((kind,), event_id, bot_username, session, expires_at)
     await session.commit()
-    await session.refresh(token)
-
-    return f"https://t.me/{bot_username}_bot?start={quote(token.token)}"
+    return links[kind]
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import secrets
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# публичный адрес, по которому Telegram достучится до бота; без него setWebhook не вызываем
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_TASKS = int(os.getenv("WEBHOOK_MAX_TASKS", "100"))
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Отвечает Telegram сразу, а апдейт обрабатывает в фоне — но не больше max_tasks одновременно.
+    Когда все слоты заняты, ответ задерживается до освобождения слота: Telegram сам
+    притормаживает доставку, а память не растёт под нагрузкой.
+    """
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str | None = None,
+                 max_tasks: int = 100, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_tasks = max_tasks
+        self._slots = asyncio.Semaphore(max_tasks)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.get("update_id"))
+        finally:
+            self._slots.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except Exception:
+            # задача не создана (например, битый JSON) — слот освобождаем сами
+            self._slots.release()
+            raise
+
+    async def close(self) -> None:
+        # дождаться апдейтов, которые уже в работе
+        if self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+        await super().close()
+
+
+def build_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH, secret: str | None = WEBHOOK_SECRET,
+              max_tasks: int = WEBHOOK_MAX_TASKS) -> web.Application:
+    app = web.Application()
+    BoundedRequestHandler(dp, bot, secret_token=secret, max_tasks=max_tasks).register(app, path=path)
+    # startup/shutdown диспетчера (в т.ч. закрытие FSM-хранилища) — вместе с приложением
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                      path: str = WEBHOOK_PATH, base_url: str | None = WEBHOOK_BASE_URL):
+    """Поднять aiohttp-сервер с вебхуком и работать до отмены."""
+    secret = WEBHOOK_SECRET
+    if not secret:
+        # с несколькими репликами секрет должен быть общим — задайте WEBHOOK_SECRET
+        secret = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET is not set, using a random one for this process")
+
+    runner = web.AppRunner(build_app(dp, bot, path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", host, port, path)
+
+    if base_url:
+        await bot.set_webhook(base_url.rstrip("/") + path, secret_token=secret,
+                              allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=True)
+        logger.info("Webhook set to %s%s", base_url.rstrip("/"), path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()